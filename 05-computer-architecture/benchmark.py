@@ -0,0 +1,175 @@
+###############################################################################
+# 05-computer-architecture/benchmark.py
+# -------------------------------------
+# Benchmarks for the Python Hack machine.
+# Each benchmark runs the sample programs (with their usual inputs) for a
+# fixed number of cycles and reports the execution speed in cycles/second.
+# Programs that end (in an `@END, 0;JMP` loop) are restarted each time they
+# reach their end, so that the halt loop is not what gets measured.
+#
+# To run: python benchmark.py
+#
+###############################################################################
+
+import os
+import tempfile
+import timeit
+from block_compiler import BlockMachine
+from decoded_machine import DecodedMachine
+from hack_machine import HackMachine
+from superinstructions import FusedMachine
+from toolchain import assemble
+from toolchain import translate
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Sample programs, with the RAM inputs they are run on
+# (Fill runs with a key held down, blackening the screen over and over)
+PROGRAMS = {
+    'Max': (os.path.join(_DIRECTORY, 'Max.hack'), {0: 3, 1: 5}),
+    'Rect': (os.path.join(_DIRECTORY, 'Rect.hack'), {0: 256}),
+    'Mult': (os.path.join(_DIRECTORY, '..', '04-machine-language', 'Mult.hack'), {0: 1000, 1: 17}),
+    'Fill': (os.path.join(_DIRECTORY, '..', '04-machine-language', 'Fill.hack'), {HackMachine.KBD: 75}),
+}
+
+# Pong (as shipped with the assembler), for benchmarks on a full Jack program
+PONG = os.path.join(_DIRECTORY, '..', '06-assembler', 'pong', 'Pong.asm')
+
+# Recursive Fibonacci (as shipped with the VM translator), for benchmarks on
+# VM-translated code, with a Sys.init computing a larger element
+FIBONACCI = os.path.join(_DIRECTORY, '..', '08-vm-program-control', 'FunctionCalls', 'FibonacciElement')
+FIBONACCI_SYS = """function Sys.init 0
+push constant 24
+call Main.fibonacci 1
+label END
+goto END
+"""
+
+# `0;JMP` instruction word
+_JUMP = 0b1110101010000111
+
+
+def _report(name, cycles, seconds, baseline=None):
+    """Prints the speed of a benchmark run (and its speedup over the baseline's time)."""
+    print(f"{name:<32} {cycles:>9} cycles  {seconds:8.3f} s  {cycles / seconds / 1e6:7.2f} Mcycles/s"
+          f"{f'  {baseline / seconds:5.2f}x' if baseline else ''}")
+
+
+def _start(machine, program):
+    """(Re)starts the sample program on the machine with its inputs."""
+    for address, value in PROGRAMS[program][1].items():
+        machine.ram[address] = value
+    machine.reset()
+
+
+def cycles_to_halt(program, max_cycles=1000000):
+    """Returns the number of cycles the program runs until it halts (or None if it does not)."""
+    machine = HackMachine(PROGRAMS[program][0])
+    _start(machine, program)
+    for cycle in range(max_cycles):
+        if machine.rom[machine.pc] == machine.pc and machine.rom[machine.pc + 1] == _JUMP:
+            return cycle
+        machine.step()
+    return None
+
+
+def run_program(machine, program, cycles, length=None):
+    """
+    Runs the sample program for `cycles` cycles, restarting it whenever it
+    halts (i.e. every `length` cycles, see cycles_to_halt()).
+    """
+    length = length or cycles
+    _start(machine, program)
+    remaining = cycles
+    while remaining > 0:
+        remaining -= machine.run(min(length, remaining))
+        _start(machine, program)
+
+
+def bench_engine(engine=HackMachine, cycles=1000000, baseline=None):
+    """
+    Times running each sample program for `cycles` cycles on the engine.
+
+    Arguments: baseline -- times of another engine (as returned by a previous
+    run) to report the speedup against
+    Returns: the time taken by each program (dict)
+    """
+    times = {}
+    for program, (filename, _) in PROGRAMS.items():
+        length = cycles_to_halt(program, cycles)
+        machine = engine(filename)
+        times[program] = timeit.timeit(lambda: run_program(machine, program, cycles, length), number=1)
+        _report(f"{engine.__name__} ({program})", cycles, times[program], baseline and baseline[program])
+    return times
+
+
+def bench_pong(engines=(HackMachine, DecodedMachine, BlockMachine), cycles=5000000):
+    """Times loading Pong and running it for `cycles` cycles on each engine."""
+    words = assemble(PONG)
+    baseline = None
+    for engine in engines:
+        machine = None
+        def load():
+            nonlocal machine
+            machine = engine(words)
+        loading = timeit.timeit(load, number=1)
+        seconds = timeit.timeit(lambda: machine.run(cycles), number=1)
+        _report(f"{engine.__name__} (Pong)", cycles, seconds, baseline)
+        baseline = baseline or seconds
+        if isinstance(machine, BlockMachine):
+            print(f"  loaded in {loading:.3f} s: {machine.block_count} blocks, {machine.blocks_compiled} compiled"
+                  f" ({machine.interpreted_cycles} cycles interpreted)")
+            loading = timeit.timeit(load, number=1)
+            print(f"  loaded again in {loading:.3f} s: {machine.blocks_compiled} blocks compiled")
+
+
+def bench_fusion(engines=(DecodedMachine, FusedMachine, BlockMachine), cycles=3000000):
+    """
+    Times running the VM-translated recursive Fibonacci for `cycles` cycles
+    on each engine, and reports the cycles run as superinstructions.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        words = assemble(translate(FIBONACCI, directory, {'Sys.vm': FIBONACCI_SYS}))
+        baseline = None
+        for engine in engines:
+            machine = engine(words)
+            seconds = timeit.timeit(lambda: machine.run(cycles), number=1)
+            _report(f"{engine.__name__} (Fibonacci)", cycles, seconds, baseline)
+            baseline = baseline or seconds
+            if isinstance(machine, FusedMachine):
+                print(f"  {machine.fused_cycles} cycles fused ({machine.fused_cycles / machine.cycles:.1%}),"
+                      f" {sum(machine.matches.values())} templates matched")
+
+
+def bench_lockstep(lanes=4096):
+    """
+    Times computing Mult on `lanes` inputs, all at once on a LockstepMachine
+    and one by one on a BlockMachine: with R0 = 100 for all the inputs (the
+    lanes run the same instructions), then with R0 from 0 to 200 (the lanes
+    leave the loop at different times). Requires NumPy.
+    """
+    from lockstep import LockstepMachine
+    filename = PROGRAMS['Mult'][0]
+    for name, first in (('same R0', lambda lane: 100), ('R0 0-200', lambda lane: lane % 201)):
+        inputs = [(first(lane), lane % 601 - 300) for lane in range(lanes)]
+        machine = LockstepMachine(filename, lanes, ram_size=32)
+        machine.ram[:, 0], machine.ram[:, 1] = zip(*inputs)
+        seconds = timeit.timeit(lambda: machine.run_until_halted(100000), number=1)
+        one_by_one = BlockMachine(filename)
+        def run_one_by_one():
+            for r0, r1 in inputs:
+                one_by_one.ram[0], one_by_one.ram[1] = r0, r1
+                one_by_one.reset()
+                one_by_one.run(16 * r0 + 20)
+        baseline = timeit.timeit(run_one_by_one, number=1)
+        print(f"Mult x {lanes} ({name}): {seconds:.3f} s lockstep, {baseline:.3f} s one by one"
+              f" ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    reference = bench_engine(HackMachine)
+    bench_engine(DecodedMachine, baseline=reference)
+    bench_engine(BlockMachine, baseline=reference)
+    bench_pong()
+    bench_fusion()
+    bench_lockstep()
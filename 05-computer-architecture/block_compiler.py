@@ -0,0 +1,241 @@
+###############################################################################
+# 05-computer-architecture/block_compiler.py
+# ------------------------------------------
+# The BlockMachine runs Hack programs as compiled Python code rather than
+# instruction by instruction.
+#
+# When a program is loaded, its ROM is split into basic blocks: straight-line
+# runs of instructions that start at a leader and end with a jump (or right
+# before the next leader). The leaders are:
+#   - address 0,
+#   - the targets of the jumps whose address is loaded just before them
+#     (`@LABEL` followed by a jump),
+#   - the instructions following a jump (where conditional jumps fall through,
+#     and where calls return to).
+# Each block becomes a Python function, with A and D kept in local variables
+# and the values loaded by A-instructions inlined as constants:
+#     def block_12(ram, a, d):
+#         d = ram[5]
+#         ram[16] = (((ram[16] + 1) + 32768) & 65535) - 32768
+#         ...
+#         return 4, d, pc
+# All the blocks are generated as Python source and compiled with compile()
+# at once; compiled blocks are cached (by address and instruction words), so
+# loading the same program again reuses them.
+#
+# Computed jumps (e.g. `@R14, A=M, 0;JMP` returning from a function) go to
+# the block starting at the target address when there is one; otherwise the
+# machine falls back to interpreting the decoded instructions (see
+# DecodedMachine) until it reaches the start of a block. It also interprets
+# the last few cycles of a run when they do not cover a whole block.
+#
+# Subclasses (the profiler, fast-forward and OS trap machines) watch or take
+# over the run through a hook, _enter(), called before each block (or
+# interpreted instruction), rather than with a run loop of their own.
+#
+###############################################################################
+
+from decoded_machine import DecodedMachine
+from hack_machine import alu
+
+
+def _wrap(expression):
+    """Wraps an expression that can overflow back to a signed 16-bit int."""
+    return f"((({expression}) + 32768) & 65535) - 32768"
+
+
+# Python expression of the ALU function of each documented comp code, of x = D and y = A or M
+COMP_EXPRESSIONS = {
+    0b101010: '0',
+    0b111111: '1',
+    0b111010: '-1',
+    0b001100: '{x}',
+    0b110000: '{y}',
+    0b001101: '~{x}',
+    0b110001: '~{y}',
+    0b001111: _wrap('-{x}'),
+    0b110011: _wrap('-{y}'),
+    0b011111: _wrap('{x} + 1'),
+    0b110111: _wrap('{y} + 1'),
+    0b001110: _wrap('{x} - 1'),
+    0b110010: _wrap('{y} - 1'),
+    0b000010: _wrap('{x} + {y}'),
+    0b010011: _wrap('{x} - {y}'),
+    0b000111: _wrap('{y} - {x}'),
+    0b000000: '{x} & {y}',
+    0b010101: '{x} | {y}',
+}
+
+# Condition on the ALU output (t) of each conditional jump code
+JUMP_EXPRESSIONS = {
+    0b001: 't > 0',
+    0b010: 't == 0',
+    0b011: 't >= 0',
+    0b100: 't < 0',
+    0b101: 't != 0',
+    0b110: 't <= 0',
+}
+
+
+class BlockMachine(DecodedMachine):
+
+    # Compiled blocks of all the programs loaded so far: (start, words) -> function
+    _block_cache = {}
+
+    # Whether run() calls _enter() (set by the subclasses defining it)
+    _hooked = False
+
+    def load(self, program):
+        """Loads a program into ROM (see HackMachine.load()) and compiles its basic blocks."""
+        super().load(program)
+        # (function, length) of the block starting at each ROM address (or None)
+        self.blocks = [None] * self.ROM_SIZE
+        # Number of this program's blocks, and of those compiled (not found in the cache)
+        self.block_count = 0
+        self.blocks_compiled = 0
+        # Number of cycles run by compiled blocks / by the interpreter
+        self.block_cycles = 0
+        self.interpreted_cycles = 0
+        self._compile_blocks()
+
+    def find_blocks(self):
+        """Returns the (start, end) ROM address range of every basic block of the program."""
+        rom, size = self.rom, self.program_size
+        leaders = {0}
+        for address in range(size):
+            instruction = rom[address]
+            if instruction & 0x8000 and instruction & 0x07:
+                leaders.add(address + 1)
+                if address > 0 and not rom[address - 1] & 0x8000:
+                    leaders.add(rom[address - 1])
+        leaders = sorted(leader for leader in leaders if leader < size)
+
+        blocks = []
+        for start, next_leader in zip(leaders, leaders[1:] + [size]):
+            end = start
+            while end < next_leader:
+                end += 1
+                if rom[end - 1] & 0x8000 and rom[end - 1] & 0x07:
+                    # Ends with a jump (what follows is a leader too)
+                    break
+            blocks.append((start, end))
+        return blocks
+
+    def _compile_blocks(self):
+        """Compiles the program's blocks (those not in the cache) and fills in the block table."""
+        blocks = self.find_blocks()
+        keys = [(start, self.rom[start:end].tobytes()) for start, end in blocks]
+        missing = [(start, end) for (start, end), key in zip(blocks, keys) if key not in self._block_cache]
+        if missing:
+            source = '\n'.join(self._block_source(start, end) for start, end in missing)
+            namespace = {'alu': alu}
+            exec(compile(source, '<hack blocks>', 'exec'), namespace)
+            for start, end in missing:
+                self._block_cache[(start, self.rom[start:end].tobytes())] = namespace[f'block_{start}']
+
+        for (start, end), key in zip(blocks, keys):
+            self.blocks[start] = (self._block_cache[key], end - start)
+        self.block_count = len(blocks)
+        self.blocks_compiled = len(missing)
+
+    def _block_source(self, start, end):
+        """Generates the Python source of the function running the block [start, end)."""
+        lines = [f"def block_{start}(ram, a, d):"]
+        # Value of A, when known at this point of the block
+        known_a = None
+        pc = f"{end & 0x7FFF}"
+        for address in range(start, end):
+            instruction = self.rom[address]
+            if not instruction & 0x8000:
+                # Only stored in `a` if it is still in A at the end of the block
+                known_a = instruction
+                continue
+
+            address_m = f"{known_a}" if known_a is not None else "a & 32767"
+            y = f"ram[{address_m}]" if instruction & 0x1000 else f"{known_a}" if known_a is not None else "a"
+            control = (instruction >> 6) & 0x3F
+            if control in COMP_EXPRESSIONS:
+                comp = COMP_EXPRESSIONS[control].format(x='d', y=y)
+            else:
+                comp = f"alu(d, {y}, {control})"
+
+            destinations = []
+            if instruction & 0x08:
+                destinations.append(f"ram[{address_m}]")
+            if instruction & 0x10:
+                destinations.append("d")
+            jump = instruction & 0x07
+            if len(destinations) == 1 and not instruction & 0x20 and not jump:
+                lines.append(f"    {destinations[0]} = {comp}")
+                continue
+            lines.append(f"    t = {comp}")
+            lines.extend(f"    {destination} = t" for destination in destinations)
+            if jump:
+                # Evaluated before A changes: the target is the address in A before the instruction
+                if jump == 0b111:
+                    lines.append(f"    pc = {address_m}")
+                else:
+                    lines.append(f"    pc = {address_m} if {JUMP_EXPRESSIONS[jump]} else {(address + 1) & 0x7FFF}")
+                pc = "pc"
+            if instruction & 0x20:
+                lines.append("    a = t")
+                known_a = None
+        lines.append(f"    return {known_a if known_a is not None else 'a'}, d, {pc}")
+        return '\n'.join(lines) + '\n'
+
+    def run(self, max_cycles):
+        """
+        Executes up to `max_cycles` instructions, running whole blocks where
+        possible (subclasses watch or change the run with _enter()).
+
+        Returns: the number of cycles executed (less than max_cycles if _enter() stopped the run)
+        """
+        blocks, ram = self.blocks, self.ram
+        enter = self._enter if self._hooked else None
+        a, d, pc = self.a, self.d, self.pc
+        remaining = max_cycles
+        block_cycles = 0
+        while remaining > 0:
+            block = blocks[pc]
+            if block is not None and block[1] > remaining:
+                # Not enough cycles left to run it
+                block = None
+            if enter is not None:
+                entered = enter(a, d, pc, block, remaining)
+                if entered is not None:
+                    a, d, pc, cycles = entered
+                    if not cycles:
+                        break
+                    remaining -= cycles
+                    continue
+            if block is not None:
+                a, d, pc = block[0](ram, a, d)
+                remaining -= block[1]
+                block_cycles += block[1]
+            else:
+                # Not the start of a block (or not enough cycles left to run it)
+                self.a, self.d, self.pc = a, d, pc
+                DecodedMachine.run(self, 1)
+                a, d, pc = self.a, self.d, self.pc
+                remaining -= 1
+                self.interpreted_cycles += 1
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += block_cycles
+        self.block_cycles += block_cycles
+        return max_cycles - remaining
+
+    def _enter(self, a, d, pc, block, remaining):
+        """
+        Called by run() before running each block or interpreted instruction,
+        in the subclasses that set `_hooked`.
+
+        Arguments:
+        a, d, pc -- the registers
+        block -- the (function, length) block about to run, or None if the
+                 instruction at pc is about to be interpreted
+        remaining -- the number of cycles left in the run
+        Returns: None to run the block (or instruction) as usual; or, when the
+        hook ran cycles itself (counting them in `cycles`), the (a, d, pc,
+        cycles) it left the machine in, with 0 cycles to stop the run
+        """
+        return None
@@ -0,0 +1,114 @@
+###############################################################################
+# 05-computer-architecture/decoded_machine.py
+# -------------------------------------------
+# The DecodedMachine is a HackMachine that decodes its ROM only once, when a
+# program is loaded, instead of on every cycle.
+#
+# Each ROM word becomes an op tuple holding everything the execution loop
+# needs, already extracted from the instruction bits:
+#   (value, comp, uses_m, writes_m, writes_d, writes_a, jump, next_pc)
+# where comp is the ALU function of the instruction (a Python function of
+# D and A/M, picked from ALU_FUNCTIONS), and jump is None (no jump), True
+# (unconditional jump) or the jump condition on the ALU output.
+# For an A-instruction, comp is None and value is the constant to load.
+#
+# The RAM, registers and results are exactly those of the HackMachine.
+#
+###############################################################################
+
+from hack_machine import HackMachine
+from hack_machine import alu
+
+
+def _wrap(function):
+    """Wraps an ALU function whose result can overflow back to a signed 16-bit int."""
+    return lambda x, y: ((function(x, y) + 0x8000) & 0xFFFF) - 0x8000
+
+
+# ALU function of each documented comp code (zx nx zy ny f no bits), of x = D and y = A or M
+ALU_FUNCTIONS = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: -1,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: ~x,
+    0b110001: lambda x, y: ~y,
+    0b001111: _wrap(lambda x, y: -x),
+    0b110011: _wrap(lambda x, y: -y),
+    0b011111: _wrap(lambda x, y: x + 1),
+    0b110111: _wrap(lambda x, y: y + 1),
+    0b001110: _wrap(lambda x, y: x - 1),
+    0b110010: _wrap(lambda x, y: y - 1),
+    0b000010: _wrap(lambda x, y: x + y),
+    0b010011: _wrap(lambda x, y: x - y),
+    0b000111: _wrap(lambda x, y: y - x),
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+# Jump condition of each jump code (null, JGT, JEQ, JGE, JLT, JNE, JLE, JMP)
+JUMP_CONDITIONS = (
+    None,
+    lambda out: out > 0,
+    lambda out: out == 0,
+    lambda out: out >= 0,
+    lambda out: out < 0,
+    lambda out: out != 0,
+    lambda out: out <= 0,
+    True,
+)
+
+
+def alu_function(control):
+    """Returns the ALU function for the 6 control bits (undocumented codes go through alu())."""
+    function = ALU_FUNCTIONS.get(control)
+    if function is None:
+        function = lambda x, y: alu(x, y, control)
+    return function
+
+
+def decode(instruction, address):
+    """Decodes the instruction word at the ROM address into its op tuple."""
+    next_pc = (address + 1) & 0x7FFF
+    if not instruction & 0x8000:
+        return (instruction, None, 0, 0, 0, 0, None, next_pc)
+    return (0, alu_function((instruction >> 6) & 0x3F), instruction & 0x1000, instruction & 0x08,
+            instruction & 0x10, instruction & 0x20, JUMP_CONDITIONS[instruction & 0x07], next_pc)
+
+
+class DecodedMachine(HackMachine):
+
+    def load(self, program):
+        """Loads a program into ROM (see HackMachine.load()) and decodes it."""
+        super().load(program)
+        self.ops = list(map(decode, self.rom, range(self.ROM_SIZE)))
+
+    def run(self, max_cycles):
+        """
+        Executes `max_cycles` instructions.
+
+        Returns: the number of cycles executed
+        """
+        ops, ram = self.ops, self.ram
+        a, d, pc = self.a, self.d, self.pc
+        for _ in range(max_cycles):
+            value, comp, uses_m, writes_m, writes_d, writes_a, jump, next_pc = ops[pc]
+            if comp is None:
+                a = value
+                pc = next_pc
+                continue
+            out = comp(d, ram[a & 0x7FFF] if uses_m else a)
+            if writes_m:
+                ram[a & 0x7FFF] = out
+            if writes_d:
+                d = out
+            if jump is not None and (jump is True or jump(out)):
+                pc = a & 0x7FFF
+            else:
+                pc = next_pc
+            if writes_a:
+                a = out
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += max_cycles
+        return max_cycles
@@ -0,0 +1,129 @@
+###############################################################################
+# 05-computer-architecture/fast_forward.py
+# ----------------------------------------
+# The FastForwardMachine is a BlockMachine that does not burn cycles in
+# loops that can only repeat themselves: the `(END) @END 0;JMP` halt loop
+# ending every translated program, `Sys.halt`, and loops polling the keyboard
+# until a key is pressed.
+#
+# Such loops are found by their state: when the machine comes back to the
+# same PC with the same A, D and RAM, it is in a cycle (the machine is
+# deterministic) that only an input can break, since the keyboard register
+# is the only memory changed from outside. The cycle is then run once more,
+# watching for keyboard reads:
+#   - a cycle that does not read the keyboard is a halt loop: nothing can
+#     ever change its state, so run() stops there (see `halted`);
+#   - a cycle that reads the keyboard is a polling loop: run() skips it ahead,
+#     by whole cycles, to the end of the cycles it was asked to run (e.g. the
+#     next event of an input trace, see keyboard.py), as if it had run them.
+# The cycles skipped this way are counted in `skipped_cycles`.
+#
+# The state is watched at a block entry, sampled every `watch_interval`
+# cycles: A and D are compared on each later entry at the same PC, and the
+# RAM only when they match (a RAM mismatch ends the watch until the next
+# sample), so that watching costs little in loops that make progress.
+#
+# To run: python fast_forward.py [--cycles N] [--keys TRACE] [--set ADDRESS=VALUE ...]
+#                                [--dump START[:END]] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+from array import array
+from block_compiler import BlockMachine
+from decoded_machine import DecodedMachine
+from hack_machine import add_ram_arguments
+from hack_machine import print_ram
+from hack_machine import set_ram
+from keyboard import InputTrace
+
+
+class FastForwardMachine(BlockMachine):
+    _hooked = True
+
+    def __init__(self, program=None, watch_interval=4096):
+        """
+        Arguments:
+        program -- optional program to load (see HackMachine.load())
+        watch_interval -- number of cycles between samples of the state
+        """
+        self.watch_interval = watch_interval
+        # Whether the last run stopped in a halt loop
+        self.halted = False
+        # Number of cycles skipped in polling loops
+        self.skipped_cycles = 0
+        super().__init__(program)
+
+    def run(self, max_cycles):
+        """
+        Executes up to `max_cycles` instructions (see BlockMachine.run()),
+        skipping polling loops ahead and stopping in halt loops.
+
+        Returns: the number of cycles executed (less than max_cycles if the
+        program halted)
+        """
+        self.halted = False
+        # Watched state: PC (or None), A, D, RAM, and remaining cycles
+        self._watch_pc = None
+        self._next_watch = max_cycles
+        return super().run(max_cycles)
+
+    def _enter(self, a, d, pc, block, remaining):
+        """Watches the state at block entries, and runs or skips the loops found (see BlockMachine._enter())."""
+        if self.halted:
+            return a, d, pc, 0
+        if block is None:
+            return None
+
+        if pc == self._watch_pc:
+            if a == self._watch_a and d == self._watch_d:
+                self._watch_pc = None
+                period = self._watch_remaining - remaining
+                if self.ram == self._watch_ram and period <= remaining:
+                    self.a, self.d, self.pc = a, d, pc
+                    if not self._run_period(period):
+                        self.halted = True
+                        return self.a, self.d, self.pc, period
+                    remaining -= period
+                    skipped = remaining - remaining % period
+                    self.cycles += skipped
+                    self.skipped_cycles += skipped
+                    self._next_watch = remaining - skipped - self.watch_interval
+                    return self.a, self.d, self.pc, period + skipped
+        elif remaining <= self._next_watch:
+            self._watch_pc, self._watch_a, self._watch_d = pc, a, d
+            self._watch_ram, self._watch_remaining = array('h', self.ram), remaining
+            self._next_watch = remaining - self.watch_interval
+        return None
+
+    def _run_period(self, period):
+        """
+        Interprets `period` instructions, watching for reads of the keyboard register.
+
+        Returns: whether the keyboard was read
+        """
+        ops = self.ops
+        reads_keyboard = False
+        for _ in range(period):
+            if ops[self.pc][2] and self.a & 0x7FFF == self.KBD:
+                reads_keyboard = True
+            DecodedMachine.run(self, 1)
+        self.interpreted_cycles += period
+        return reads_keyboard
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Hack program, skipping its halt and polling loops.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    arg_parser.add_argument('--keys', metavar='TRACE', help="keyboard trace file to replay (see keyboard.py)")
+    add_ram_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    machine = FastForwardMachine(args.filename)
+    set_ram(machine, args.set)
+    (InputTrace.load(args.keys) if args.keys else InputTrace()).run(machine, args.cycles)
+
+    print(f"PC={machine.pc} A={machine.a} D={machine.d} ({machine.cycles} cycles, {machine.skipped_cycles} skipped"
+          f"{', halted' if machine.halted else ''})")
+    print_ram(machine, args.dump)
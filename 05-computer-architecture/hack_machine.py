@@ -0,0 +1,231 @@
+###############################################################################
+# 05-computer-architecture/hack_machine.py
+# ----------------------------------------
+# The HackMachine executes Hack machine code (the .hack programs written by
+# 06-assembler/assembler.py, or its binary .rom images) in Python, following
+# the Hack CPU (CPU.hdl) cycle by cycle:
+#   - an A-instruction loads its 15-bit value into the A register;
+#   - a C-instruction computes the ALU function of D and A (or M = RAM[A]),
+#     stores the result in any of A, D and M, and jumps to the address held
+#     in A (before the instruction) if the result satisfies the jump condition.
+#
+# The ROM holds 32K 16-bit words. The RAM is kept as an array of signed
+# 16-bit words (array('h')), covering the whole 15-bit address space: the
+# data memory (0-16383), the screen (SCREEN = 0x4000) and the keyboard
+# register (KBD = 0x6000).
+#
+# This engine decodes every instruction on every cycle, as the hardware does;
+# it is the reference the faster engines are checked against.
+#
+# The command lines of all the machines share the --set and --dump options,
+# parsed and checked here (see add_ram_arguments()): values are 16-bit words,
+# decimal or 0x-prefixed hexadecimal, and addresses must be in RAM.
+#
+# To run: python hack_machine.py [--cycles N] [--set ADDRESS=VALUE ...]
+#                                [--dump START[:END]] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+from array import array
+from toolchain import Rom
+
+
+def alu(x, y, control):
+    """
+    Computes the Hack ALU function of x and y (signed 16-bit ints).
+
+    Arguments: control -- the 6 control bits zx, nx, zy, ny, f, no (int)
+    Returns: the (signed 16-bit) output of the ALU
+    """
+    if control & 0x20:  # zx
+        x = 0
+    if control & 0x10:  # nx
+        x = ~x
+    if control & 0x08:  # zy
+        y = 0
+    if control & 0x04:  # ny
+        y = ~y
+    out = x + y if control & 0x02 else x & y  # f
+    if control & 0x01:  # no
+        out = ~out
+    return ((out + 0x8000) & 0xFFFF) - 0x8000
+
+
+class HackMachine:
+    ROM_SIZE = 32768    # 32K instruction words
+    RAM_SIZE = 32768    # 15-bit data addresses
+    SCREEN = 0x4000     # Screen memory map (8K words)
+    KBD = 0x6000        # Keyboard memory map (1 word)
+
+    def __init__(self, program=None):
+        """
+        Creates a machine with an empty ROM and cleared RAM and registers.
+
+        Arguments: program -- optional program to load (see load())
+        """
+        self.rom = array('H', bytes(2 * self.ROM_SIZE))
+        self.ram = array('h', bytes(2 * self.RAM_SIZE))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        # Number of cycles (instructions) executed so far
+        self.cycles = 0
+        # Number of words of the loaded program
+        self.program_size = 0
+        if program is not None:
+            self.load(program)
+
+    def load(self, program):
+        """
+        Loads a program into ROM (the rest of ROM is cleared), and resets the machine.
+
+        Arguments: program -- a .hack program or .rom image filename, or the
+        instruction words (any iterable of ints)
+        """
+        words = array('H', Rom.load(program) if isinstance(program, str) else program)
+        if len(words) > self.ROM_SIZE:
+            raise HackMachineError(f"{len(words)} words do not fit in the {self.ROM_SIZE}-word ROM.")
+        self.rom[:len(words)] = words
+        self.rom[len(words):] = array('H', bytes(2 * (self.ROM_SIZE - len(words))))
+        self.program_size = len(words)
+        self.reset()
+
+    def reset(self):
+        """Restarts the program: sets PC to 0 (like the CPU's reset input; registers and RAM are kept)."""
+        self.pc = 0
+
+    def step(self):
+        """Executes a single instruction."""
+        self.run(1)
+
+    def run(self, max_cycles):
+        """
+        Executes `max_cycles` instructions.
+
+        Returns: the number of cycles executed
+        """
+        rom, ram = self.rom, self.ram
+        a, d, pc = self.a, self.d, self.pc
+        for _ in range(max_cycles):
+            instruction = rom[pc]
+            if not instruction & 0x8000:
+                # A-instruction: @value
+                a = instruction
+                pc = (pc + 1) & 0x7FFF
+                continue
+
+            # C-instruction: dest=comp;jump (bits 111a cccc ccdd djjj)
+            address = a & 0x7FFF
+            out = alu(d, ram[address] if instruction & 0x1000 else a, (instruction >> 6) & 0x3F)
+            if instruction & 0x08:
+                ram[address] = out
+            if instruction & 0x10:
+                d = out
+            if ((instruction & 0x04 and out < 0) or (instruction & 0x02 and out == 0)
+                    or (instruction & 0x01 and out > 0)):
+                pc = address
+            else:
+                pc = (pc + 1) & 0x7FFF
+            if instruction & 0x20:
+                a = out
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += max_cycles
+        return max_cycles
+
+
+# For Hack machine error exception; does nothing (just for convention)
+class HackMachineError(Exception):
+    pass
+
+
+def word(value):
+    """Wraps an int to a signed 16-bit word."""
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def parse_int(value):
+    """Parses a decimal or 0x-prefixed hexadecimal int."""
+    return int(value, 0)
+
+
+# Command-line options of the machines: --set ADDRESS=VALUE and --dump START[:END]
+
+def _ram_address(text):
+    """Parses a RAM address of an option (argparse.ArgumentTypeError if invalid)."""
+    try:
+        address = parse_int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid address '{text}'")
+    if not 0 <= address < HackMachine.RAM_SIZE:
+        raise argparse.ArgumentTypeError(f"address {address} is out of RAM (0-{HackMachine.RAM_SIZE - 1})")
+    return address
+
+
+def ram_assignment(text):
+    """
+    Parses a --set ADDRESS=VALUE option (argparse type), the value being any
+    16-bit word (e.g. -1 or 0xFFFF). Returns: (address, signed word)
+    """
+    address, separator, value = text.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected ADDRESS=VALUE, got '{text}'")
+    try:
+        value = parse_int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid value '{value}'")
+    if not -0x8000 <= value <= 0xFFFF:
+        raise argparse.ArgumentTypeError(f"value {value} is not a 16-bit word")
+    return _ram_address(address), word(value)
+
+
+def ram_range(text):
+    """Parses a --dump START[:END] option (argparse type). Returns: the range of RAM addresses"""
+    start, _, end = text.partition(':')
+    start = _ram_address(start)
+    if not end:
+        return range(start, start + 1)
+    try:
+        end = parse_int(end)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid end address '{end}'")
+    if not start <= end <= HackMachine.RAM_SIZE:
+        raise argparse.ArgumentTypeError(f"end address {end} is not in {start}-{HackMachine.RAM_SIZE}")
+    return range(start, end)
+
+
+def add_ram_arguments(arg_parser, assignments=True, dump=True):
+    """Adds the --set and/or --dump options to the argument parser of a machine."""
+    if assignments:
+        arg_parser.add_argument('--set', action='append', default=[], type=ram_assignment, metavar='ADDRESS=VALUE',
+                                help="set a RAM word before running (can be repeated)")
+    if dump:
+        arg_parser.add_argument('--dump', default='0:16', type=ram_range, metavar='START[:END]',
+                                help="RAM words to print after running (default: 0:16)")
+
+
+def set_ram(machine, assignments):
+    """Sets the RAM words of the --set options."""
+    for address, value in assignments:
+        machine.ram[address] = value
+
+
+def print_ram(machine, addresses):
+    """Prints the RAM words of the --dump option."""
+    for address in addresses:
+        print(f"RAM[{address}] = {machine.ram[address]}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Hack program.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    add_ram_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    machine = HackMachine(args.filename)
+    set_ram(machine, args.set)
+    machine.run(args.cycles)
+
+    print(f"PC={machine.pc} A={machine.a} D={machine.d} ({machine.cycles} cycles)")
+    print_ram(machine, args.dump)
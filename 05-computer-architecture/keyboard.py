@@ -0,0 +1,162 @@
+###############################################################################
+# 05-computer-architecture/keyboard.py
+# ------------------------------------
+# The InputTrace replays scripted keyboard input into a Python Hack machine,
+# so that interactive programs (Fill, the Jack games) can run unattended and
+# deterministically: the same trace gives the same run, cycle for cycle.
+#
+# A trace is a list of (cycle, keycode) events: at the given cycle (the number
+# of cycles the machine has run, see HackMachine.cycles), the keycode is put
+# in the keyboard register (RAM[KBD] = RAM[0x6000]), where it stays until the
+# next event; keycode 0 releases the key. The machine runs up to each event
+# with its run() method, so any engine can be driven by a trace.
+#
+# Trace files hold one event per line, the cycle then the key: a single
+# character (`5` types the digit 5, keycode 53), a keycode (`#130`, or any
+# number of two digits or more), or the name of a special key of the Hack
+# character set (e.g. LEFT, SPACE, NEWLINE), or NONE to release the key.
+# Comments (//) and blank lines are ignored:
+#     // Press right arrow for 1M cycles, then type 5
+#     100000   RIGHT
+#     1100000  NONE
+#     1200000  5
+#     1300000  #0
+#
+# To run: python keyboard.py [--cycles N] [--set ADDRESS=VALUE ...]
+#                            [--dump START[:END]] <program>.hack|.rom <trace>
+#
+###############################################################################
+
+import argparse
+from bisect import bisect_right
+from block_compiler import BlockMachine
+from hack_machine import HackMachine
+from hack_machine import add_ram_arguments
+from hack_machine import print_ram
+from hack_machine import set_ram
+
+
+# Keycodes of the keys with names (Hack character set)
+KEY_CODES = {
+    'NONE': 0,
+    'SPACE': 32,
+    'NEWLINE': 128,
+    'BACKSPACE': 129,
+    'LEFT': 130,
+    'UP': 131,
+    'RIGHT': 132,
+    'DOWN': 133,
+    'HOME': 134,
+    'END': 135,
+    'PAGEUP': 136,
+    'PAGEDOWN': 137,
+    'INSERT': 138,
+    'DELETE': 139,
+    'ESC': 140,
+    **{f'F{number}': 140 + number for number in range(1, 13)},
+}
+
+
+class InputTrace:
+
+    def __init__(self, events=()):
+        """
+        Arguments: events -- the (cycle, keycode) events (in any order; events
+        at the same cycle keep their order, the last one wins)
+        """
+        self.events = sorted(events, key=lambda event: event[0])
+        self._cycles = [cycle for cycle, _ in self.events]
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a trace file."""
+        events = []
+        with open(filename) as trace_file:
+            for line_number, line in enumerate(trace_file, 1):
+                line = line.split('//', 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    cycle, key = line.split()
+                    events.append((int(cycle), cls.keycode(key)))
+                except ValueError:
+                    raise InputTraceError(f"{filename}:{line_number}: expected <cycle> <key>, got '{line}'.")
+        return cls(events)
+
+    @staticmethod
+    def keycode(key):
+        """
+        Returns the keycode of a key: a single character (so that digits are
+        typed as digits), a keycode (`#N`, or a number of several digits) or a
+        key name (see KEY_CODES).
+        """
+        if len(key) == 1:
+            return ord(key)
+        if key.startswith('#') and key[1:].isdigit():
+            return int(key[1:])
+        if key.isdigit():
+            return int(key)
+        if key.upper() in KEY_CODES:
+            return KEY_CODES[key.upper()]
+        raise ValueError(f"Unknown key: {key}")
+
+    def write(self, stream):
+        """Writes the trace to the stream, in the trace file format (with keycodes)."""
+        for cycle, keycode in self.events:
+            stream.write(f"{cycle} #{keycode}\n")
+
+    def next_event(self, cycle):
+        """Returns the cycle of the first event after `cycle` (or None)."""
+        index = bisect_right(self._cycles, cycle)
+        return self._cycles[index] if index < len(self._cycles) else None
+
+    def key_at(self, cycle):
+        """Returns the keycode in the keyboard register at `cycle` (None before the first event)."""
+        index = bisect_right(self._cycles, cycle)
+        return self.events[index - 1][1] if index else None
+
+    def run(self, machine, cycles):
+        """
+        Runs the machine for `cycles` cycles, setting the keyboard register
+        at each event's cycle (the events before the machine's current cycle
+        are already past: only the key they leave pressed is set).
+
+        Returns: the number of cycles executed (less than `cycles` if the
+        machine stopped early, see fast_forward.py)
+        """
+        start = machine.cycles
+        end = start + cycles
+        keycode = self.key_at(machine.cycles)
+        if keycode is not None:
+            machine.ram[HackMachine.KBD] = keycode
+        while machine.cycles < end:
+            event_cycle = self.next_event(machine.cycles)
+            if event_cycle is None or event_cycle > end:
+                machine.run(end - machine.cycles)
+                break
+            wanted = event_cycle - machine.cycles
+            if machine.run(wanted) < wanted:
+                break
+            machine.ram[HackMachine.KBD] = self.key_at(event_cycle)
+        return machine.cycles - start
+
+
+# For input trace error exception; does nothing (just for convention)
+class InputTraceError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Hack program with scripted keyboard input.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('trace', help="the keyboard trace file")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    add_ram_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    machine = BlockMachine(args.filename)
+    set_ram(machine, args.set)
+    InputTrace.load(args.trace).run(machine, args.cycles)
+
+    print(f"PC={machine.pc} A={machine.a} D={machine.d} ({machine.cycles} cycles)")
+    print_ram(machine, args.dump)
@@ -0,0 +1,241 @@
+###############################################################################
+# 05-computer-architecture/lockstep.py
+# ------------------------------------
+# The LockstepMachine runs the same Hack program on many machines (lanes) at
+# once, typically on different RAM inputs: a regression test of thousands of
+# cases runs in a single pass.
+#
+# The lanes share the ROM; each has its own A, D and PC registers and RAM,
+# kept in NumPy arrays (one element / row per lane). Every cycle executes one
+# instruction on all the lanes, vectorized:
+#   - while all the lanes are at the same PC (the same program on different
+#     data mostly runs the same instructions), the instruction is decoded once
+#     and its ALU function (alu() of hack_machine.py) applied to the whole
+#     A, D and M arrays; while A is the same for all the lanes too (it was just
+#     loaded by an A-instruction), M is a single RAM column;
+#   - once the lanes diverge (a conditional jump taken by some of them only),
+#     each lane fetches the instruction at its own PC, and the ALU of CPU.hdl
+#     (zx, nx, zy, ny, f, no), destinations and jumps are computed through
+#     masks of the instruction bits, until the PCs meet again.
+# run_until_halted() sets aside the lanes that have halted, so that the others
+# can run at the same PC again.
+#
+# Each lane's RAM can be limited to its first `ram_size` words (the whole
+# 32K address space of thousands of lanes would take hundreds of MB); an
+# access beyond them raises a LockstepError.
+#
+# Requires NumPy.
+#
+###############################################################################
+
+import numpy as np
+from decoded_machine import JUMP_CONDITIONS
+from hack_machine import HackMachine
+from hack_machine import alu
+from toolchain import Rom
+
+# `0;JMP` instruction word
+_JUMP = 0b1110101010000111
+
+
+class LockstepMachine:
+
+    def __init__(self, program, lanes, ram_size=HackMachine.RAM_SIZE):
+        """
+        Arguments:
+        program -- a .hack program or .rom image filename, or the instruction words
+        lanes -- number of machines
+        ram_size -- number of RAM words of each machine
+        """
+        words = Rom.load(program) if isinstance(program, str) else program
+        if len(words) > HackMachine.ROM_SIZE:
+            raise LockstepError(f"{len(words)} words do not fit in the {HackMachine.ROM_SIZE}-word ROM.")
+        self.rom = np.zeros(HackMachine.ROM_SIZE + 1, dtype=np.int32)
+        self.rom[:len(words)] = np.asarray(words, dtype=np.uint16)
+        self._words = self.rom.tolist()
+        self.lanes = lanes
+        self.ram_size = ram_size
+        self.ram = np.zeros((lanes, ram_size), dtype=np.int16)
+        # The RAM of all the lanes as a single array (view)
+        self._memory = self.ram.reshape(-1)
+        self.a = np.zeros(lanes, dtype=np.int32)
+        self.d = np.zeros(lanes, dtype=np.int32)
+        self.pc = np.zeros(lanes, dtype=np.int32)
+        self.cycles = 0
+        self._lane_indices = np.arange(lanes)
+
+    def reset(self):
+        """Restarts the program on every lane (PC = 0; registers and RAM are kept)."""
+        self.pc[:] = 0
+
+    def run(self, max_cycles):
+        """
+        Executes `max_cycles` instructions on every lane.
+
+        Returns: the number of cycles executed
+        """
+        self.a, self.d, self.pc = self._run(self._lane_indices, self.a, self.d, self.pc, max_cycles)
+        self.cycles += max_cycles
+        return max_cycles
+
+    def run_until_halted(self, max_cycles, check_every=64):
+        """
+        Executes instructions until every lane has halted (see halted()),
+        or at most about `max_cycles` cycles. The lanes that have halted are
+        not run any further (they stay in their halt loop).
+
+        Returns: the number of cycles executed
+        """
+        rows = self._lane_indices
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+        while cycles < max_cycles:
+            running = ~self._halted(a, pc)
+            if not running.all():
+                self.a[rows], self.d[rows], self.pc[rows] = a, d, pc
+                rows, a, d, pc = rows[running], a[running], d[running], pc[running]
+                if not len(rows):
+                    break
+            # Diverged lanes are checked more often: they may be the last few reaching their halt loop
+            count = min(check_every if (pc == pc[0]).all() else 4, max_cycles - cycles)
+            a, d, pc = self._run(rows, a, d, pc, count)
+            cycles += count
+        self.a[rows], self.d[rows], self.pc[rows] = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+    def halted(self):
+        """Returns the lanes spinning in an `@X, 0;JMP` loop at address X (boolean array)."""
+        return self._halted(self.a, self.pc)
+
+    def _halted(self, a, pc):
+        """Returns which of the lanes of registers a and pc are in their halt loop."""
+        rom = self.rom
+        at_load = (rom[pc] == pc) & (rom[pc + 1] == _JUMP)
+        at_jump = (rom[pc] == _JUMP) & (a == pc - 1) & (rom[pc - 1] == pc - 1)
+        return at_load | at_jump
+
+    def _cells(self, rows, address, accessed=True):
+        """
+        Returns the indices, in the flattened RAM, of the words at `address`
+        (one address, or one per lane) of the lanes in `rows`.
+        Raises a LockstepError if an accessed address (see the `accessed` mask)
+        is out of the lanes' RAM.
+        """
+        if np.any((address >= self.ram_size) & accessed):
+            raise LockstepError(f"RAM address out of the {self.ram_size}-word RAM of the lanes.")
+        return rows * self.ram_size + np.minimum(address, self.ram_size - 1)
+
+    def _run(self, rows, a, d, pc, cycles):
+        """
+        Executes `cycles` instructions on the lanes in `rows` (index array),
+        whose registers are a, d and pc (arrays).
+
+        Returns: the new a, d, pc arrays
+        """
+        words, memory = self._words, self._memory
+        # PC / A of all the lanes when they are the same (or None): A is only
+        # stored in the `a` array when the lanes leave the same PC
+        same_pc = int(pc[0]) if (pc == pc[0]).all() else None
+        same_a = None
+        for _ in range(cycles):
+            if same_pc is None:
+                a, d, pc = self._step(rows, a, d, pc)
+                if (pc == pc[0]).all():
+                    same_pc = int(pc[0])
+                continue
+
+            instruction = words[same_pc]
+            if not instruction & 0x8000:
+                same_a = instruction
+                same_pc = (same_pc + 1) & 0x7FFF
+                continue
+
+            address = same_a & 0x7FFF if same_a is not None else a & 0x7FFF
+            if instruction & 0x1008:
+                cells = self._cells(rows, address)
+            if instruction & 0x1000:
+                y = memory.take(cells).astype(np.int32)
+            else:
+                y = same_a if same_a is not None else a
+            out = alu(d, y, (instruction >> 6) & 0x3F)
+            if np.ndim(out) == 0:
+                # Constant, or a function of a single A
+                out = np.full(len(rows), out, dtype=np.int32)
+            if instruction & 0x08:
+                memory[cells] = out
+            if instruction & 0x10:
+                d = out
+
+            jump = JUMP_CONDITIONS[instruction & 0x07]
+            next_pc = (same_pc + 1) & 0x7FFF
+            if jump is not None:
+                taken = jump is True or jump(out)
+                if taken is True or taken.all():
+                    if same_a is not None:
+                        same_pc = address
+                    else:
+                        pc = address
+                        same_pc = int(pc[0]) if (pc == pc[0]).all() else None
+                elif not taken.any():
+                    same_pc = next_pc
+                else:
+                    pc = np.where(taken, address, next_pc)
+                    same_pc = None
+            else:
+                same_pc = next_pc
+
+            if instruction & 0x20:
+                a = out
+                same_a = None
+            if same_pc is None and same_a is not None:
+                # The lanes diverge: A back in the array
+                a = np.full(len(rows), same_a, dtype=np.int32)
+                same_a = None
+        if same_pc is not None:
+            pc = np.full(len(rows), same_pc, dtype=np.int32)
+        if same_a is not None:
+            a = np.full(len(rows), same_a, dtype=np.int32)
+        return a, d, pc
+
+    def _step(self, rows, a, d, pc):
+        """
+        Executes one instruction on each of the lanes in `rows`, at their own PC.
+
+        Returns: the new a, d, pc arrays
+        """
+        instruction = self.rom.take(pc)
+        # Masks of the instruction bits: 0 or -1 (all bits set) for each lane
+        bit = lambda position: -((instruction >> position) & 1)
+        c_instruction = bit(15)
+        address = a & 0x7FFF
+        reads = (instruction & 0x9000) == 0x9000
+        writes = (instruction & 0x8008) == 0x8008
+        y = a
+        if reads.any() or writes.any():
+            cells = self._cells(rows, address, reads | writes)
+            y = np.where(reads, self._memory.take(cells), a)
+
+        # ALU: x = zx ? 0 : D, then x = nx ? !x : x (the same for y),
+        # out = f ? x + y : x & y, then out = no ? !out : out
+        x = (d & ~bit(11)) ^ bit(10)
+        y = (y & ~bit(9)) ^ bit(8)
+        add = bit(7)
+        out = (((x + y) & add) | (x & y & ~add)) ^ bit(6)
+        out = out.astype(np.int16).astype(np.int32)
+
+        if writes.any():
+            self._memory[cells[writes]] = out[writes]
+        writes_d = c_instruction & bit(4)
+        d = (out & writes_d) | (d & ~writes_d)
+        jump = c_instruction & ((bit(2) & (out < 0)) | (bit(1) & (out == 0)) | (bit(0) & (out > 0)))
+        pc = np.where(jump, address, (pc + 1) & 0x7FFF)
+        # A-instructions load their value, C-instructions may store out
+        writes_a = c_instruction & bit(5)
+        a = np.where(c_instruction, (out & writes_a) | (a & ~writes_a), instruction)
+        return a, d, pc
+
+
+# For lockstep machine error exception; does nothing (just for convention)
+class LockstepError(Exception):
+    pass
@@ -0,0 +1,375 @@
+###############################################################################
+# 05-computer-architecture/os_traps.py
+# ------------------------------------
+# The OSTrapMachine is a BlockMachine that runs the slowest routines of the
+# Jack OS as native Python code (high-level emulation): Math.multiply and
+# Math.divide (bit-by-bit loops), Memory.alloc (a walk of the free list),
+# and Screen.drawLine, Screen.drawRectangle and Screen.clearScreen (a call
+# chain or a loop for each pixel or word). Jack programs spend most of their
+# cycles in them.
+#
+# OS functions are found from the labels of the program's symbol map (the .map
+# file written by `assembler.py --map`): both VM translators (08 and the
+# book's) start each function with a `Class.function` label, upper-cased or
+# lower-cased. When the PC reaches a trapped function's label, the machine
+# is right after the call: the VM calling convention gives the arguments
+# (RAM[ARG], RAM[ARG + 1], ...) and the caller's frame (return address,
+# LCL, ARG, THIS, THAT, pushed just below SP). The native version computes
+# the result, then returns as the VM `return` does: the result replaces the
+# first argument, SP points after it, the caller's segment pointers are
+# restored and the PC goes to the return address. The registers are left as
+# the program's own `return` code leaves them: A holds the return address,
+# D the caller's LCL, and R13 and R14 the return address and the frame
+# pointer (the translators use them the other way round: 08 keeps the return
+# address in R14, the book's in R13, which is read from the `return` code in
+# ROM). A trapped call counts as one cycle.
+#
+# The native versions are transliterations of the OS that programs are
+# linked with (the compiled book OS, tools/OS/*.vm), down to the comparisons
+# of the VM translators (the sign of a difference that can overflow): they
+# give the same results and leave the same memory (screen, heap and OS
+# statics, e.g. the Math.divide scratch array, found from the map's static
+# variables), except for the scratch memory of the Hack code they replace
+# (the temp segment and the stack above SP). The cases where the OS would
+# call Sys.error (e.g. a division by zero or a pixel off the screen) are left
+# to the Hack code.
+#
+# To run: python os_traps.py [--map FILE] [--cycles N] [--only FUNCTION ...]
+#                            [--dump START[:END]] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+import os
+from block_compiler import BlockMachine
+from hack_machine import add_ram_arguments
+from hack_machine import print_ram
+from hack_machine import word
+from toolchain import InMemoryAssembler
+from toolchain import SymbolMap
+
+
+def _lt(x, y):
+    """The VM `lt` command: the sign of the difference (which overflows, as on Hack)."""
+    return word(x - y) < 0
+
+
+def _gt(x, y):
+    """The VM `gt` command: the sign of the difference (which overflows, as on Hack)."""
+    return word(x - y) > 0
+
+
+class OSTrapMachine(BlockMachine):
+    # Trapped functions: label (upper-cased) -> (method, number of arguments, static variables used)
+    FUNCTIONS = {
+        'MATH.MULTIPLY': ('_multiply', 2, ()),
+        'MATH.DIVIDE': ('_divide', 2, ('MATH.0', 'MATH.1')),
+        'MEMORY.ALLOC': ('_alloc', 1, ()),
+        'SCREEN.CLEARSCREEN': ('_clear_screen', 0, ('SCREEN.1',)),
+        'SCREEN.DRAWLINE': ('_draw_line', 4, ('SCREEN.0', 'SCREEN.1', 'SCREEN.2', 'MATH.0', 'MATH.1')),
+        'SCREEN.DRAWRECTANGLE': ('_draw_rectangle', 4, ('SCREEN.0', 'SCREEN.1', 'SCREEN.2', 'MATH.0', 'MATH.1')),
+    }
+
+    HEAP_BASE = 2048
+    HEAP_END = 16384
+
+    # Code of the VM `return` (both translators): the return address is saved
+    # in a register (`@R13` or `@R14`, then `M=D`) right after the first
+    # sequence, and the frame pointer is walked down (`@R13` or `@R14`, then
+    # the second sequence) to restore THIS
+    _SAVE_RETURN_ADDRESS = InMemoryAssembler(['@5', 'D=A', '@LCL', 'A=M-D', 'D=M']).words
+    _RESTORE_THIS = InMemoryAssembler(['AM=M-1', 'D=M', '@THIS', 'M=D']).words
+
+    _hooked = True
+
+    def __init__(self, program=None, symbols=None, functions=None):
+        """
+        Arguments:
+        program -- optional program to load (see HackMachine.load())
+        symbols -- the program's symbols ({symbol: address}), or its .map file
+        (by default, the .map file next to the program file)
+        functions -- the functions to trap (default: all of FUNCTIONS)
+        """
+        if symbols is None and isinstance(program, str):
+            symbols = os.path.splitext(program)[0] + '.map'
+        if isinstance(symbols, str):
+            if not os.path.exists(symbols):
+                raise OSTrapError(f"No symbol map {symbols}: assemble the program with --map.")
+            symbol_map = SymbolMap.load(symbols)
+            symbols = {**symbol_map.labels, **symbol_map.variables}
+        self.symbols = {name.upper(): address for name, address in (symbols or {}).items()}
+        self.functions = [function.upper() for function in functions] if functions else list(self.FUNCTIONS)
+        for function in self.functions:
+            if function not in self.FUNCTIONS:
+                raise OSTrapError(f"No native version of {function}.")
+        super().__init__(program)
+
+    def load(self, program):
+        """Loads a program into ROM (see BlockMachine.load()) and sets the traps of its OS functions."""
+        super().load(program)
+        # Traps: function address -> (function, native method, number of arguments)
+        self.traps = {}
+        for function in self.functions:
+            method, num_args, variables = self.FUNCTIONS[function]
+            if function in self.symbols and all(variable in self.symbols for variable in variables):
+                self.traps[self.symbols[function]] = (function, getattr(self, method), num_args)
+        # Number of trapped calls of each function
+        self.trapped_calls = {}
+        # Registers the program's `return` code leaves the return address
+        # and the frame pointer in (None if it has none)
+        self._return_registers = self._find_return_registers()
+
+    def _find_return_registers(self):
+        """
+        Finds the registers the VM `return` code of the program (in ROM) keeps
+        the return address and the frame pointer in.
+
+        Returns: (return address register, frame register), or None
+        """
+        rom = self.rom[:self.program_size].tobytes()
+
+        def find(words):
+            """Returns the address of the words in ROM (or None)."""
+            pattern = words.tobytes()
+            index = rom.find(pattern)
+            while index >= 0 and index % 2:
+                index = rom.find(pattern, index + 1)
+            return index // 2 if index >= 0 else None
+
+        save_return_address = find(self._SAVE_RETURN_ADDRESS)
+        restore_this = find(self._RESTORE_THIS)
+        if save_return_address is None or restore_this is None:
+            return None
+        return_register = self.rom[save_return_address + len(self._SAVE_RETURN_ADDRESS)]
+        frame_register = self.rom[restore_this - 1]
+        if {return_register, frame_register} != {13, 14}:
+            return None
+        return return_register, frame_register
+
+    def _enter(self, a, d, pc, block, remaining):
+        """Runs the trapped OS functions natively (see BlockMachine._enter())."""
+        trap = self.traps.get(pc)
+        if trap is None:
+            return None
+        function, native, num_args = trap
+        ram = self.ram
+        arg = ram[2]
+        result = native(*(ram[(arg + index) & 0x7FFF] for index in range(num_args)))
+        if result is None:
+            return None
+        self.cycles += 1
+        self.trapped_calls[function] = self.trapped_calls.get(function, 0) + 1
+        return *self._return(result), 1
+
+    def _return(self, result):
+        """
+        Returns from the function just called with the result, as the VM
+        `return` does (the function's frame starts at SP: no local was pushed).
+
+        Returns: the (a, d, pc) registers after the return
+        """
+        ram = self.ram
+        frame = ram[0]
+        return_address = ram[(frame - 5) & 0x7FFF]
+        arg = ram[2]
+        ram[arg & 0x7FFF] = result
+        ram[0] = arg + 1
+        ram[4] = ram[(frame - 1) & 0x7FFF]
+        ram[3] = ram[(frame - 2) & 0x7FFF]
+        ram[2] = ram[(frame - 3) & 0x7FFF]
+        ram[1] = ram[(frame - 4) & 0x7FFF]
+        if self._return_registers is not None:
+            return_register, frame_register = self._return_registers
+            ram[return_register] = return_address
+            ram[frame_register] = frame - 4
+        return return_address, ram[1], return_address & 0x7FFF
+
+    def _static(self, variable):
+        """Returns the value of an OS static variable."""
+        return self.ram[self.symbols[variable]]
+
+    # Native versions of the OS functions: they return the function's result
+    # (None to leave the call to the Hack code)
+
+    def _multiply(self, x, y):
+        """Math.multiply(x, y)"""
+        if x == -0x8000 or y == -0x8000:
+            # Math.abs() overflows: let the shift-and-add loop deal with it
+            return None
+        return word(x * y)
+
+    def _divide(self, x, y):
+        """
+        Math.divide(x, y): fills the powers of |y| in the scratch array
+        (Math.1) up to |x|, then subtracts them from |x|.
+        """
+        if y == 0:
+            return None
+        ram = self.ram
+        powers_of_two, powers_of_y = self._static('MATH.0'), self._static('MATH.1')
+        negative = (x < 0 < y) or (y < 0 < x)
+        x = word(abs(x))
+        ram[powers_of_y & 0x7FFF] = word(abs(y))
+        j = 0
+        done = False
+        while j < 15 and not done:
+            power = ram[(powers_of_y + j) & 0x7FFF]
+            done = _lt(word(32767 - word(power - 1)), word(power - 1))
+            if not done:
+                ram[(powers_of_y + j + 1) & 0x7FFF] = word(power + power)
+                done = _gt(word(ram[(powers_of_y + j + 1) & 0x7FFF] - 1), word(x - 1))
+                if not done:
+                    j += 1
+        result = 0
+        while j > -1:
+            power = ram[(powers_of_y + j) & 0x7FFF]
+            if not _gt(word(power - 1), word(x - 1)):
+                result = word(result + ram[(powers_of_two + j) & 0x7FFF])
+                x = word(x - power)
+            j -= 1
+        return word(-result) if negative else result
+
+    def _alloc(self, size):
+        """
+        Memory.alloc(size): first fit in the list of heap segments (word 0:
+        free size, 0 if allocated; word 1: next segment), merging the free
+        segments it walks past, then splits the segment found.
+        """
+        if size < 0:
+            return None
+        ram = self.ram
+        size = size or 1
+        # (address, old value) of the words written, to undo them if the heap is full
+        writes = []
+
+        def write(address, value):
+            address &= 0x7FFF
+            writes.append((address, ram[address]))
+            ram[address] = value
+
+        segment = self.HEAP_BASE
+        for _ in range(2 * self.HEAP_END):
+            if not (_lt(segment, self.HEAP_END - 1) and _lt(ram[segment & 0x7FFF], size)):
+                break
+            following = ram[(segment + 1) & 0x7FFF]
+            if ram[segment & 0x7FFF] == 0 or _gt(following, self.HEAP_END - 2) or ram[following & 0x7FFF] == 0:
+                segment = following
+            else:
+                # Merge the following (free) segment into this one
+                write(segment, word(following - segment + ram[following & 0x7FFF]))
+                if ram[(following + 1) & 0x7FFF] == word(following + 2):
+                    write(segment + 1, word(segment + 2))
+                else:
+                    write(segment + 1, ram[(following + 1) & 0x7FFF])
+        else:
+            # Endless walk (the heap is full or broken): let the Hack code loop
+            segment = None
+        if segment is None or _gt(word(segment + size), self.HEAP_END - 5):
+            # Heap full (Sys.error)
+            for address, value in reversed(writes):
+                ram[address] = value
+            return None
+
+        if _gt(ram[segment & 0x7FFF], word(size + 2)):
+            # Split: the rest of the segment becomes the next one
+            write(segment + size + 2, word(ram[segment & 0x7FFF] - size - 2))
+            if ram[(segment + 1) & 0x7FFF] == word(segment + 2):
+                write(segment + size + 3, word(segment + size + 4))
+            else:
+                write(segment + size + 3, ram[(segment + 1) & 0x7FFF])
+            write(segment + 1, word(segment + size + 2))
+        write(segment, 0)
+        return word(segment + 2)
+
+    def _clear_screen(self):
+        """Screen.clearScreen()"""
+        screen = self._static('SCREEN.1')
+        for address in range(screen, screen + 8192):
+            self.ram[address & 0x7FFF] = 0
+        return 0
+
+    def _update(self, address, mask):
+        """Screen.updateLocation(address, mask): sets (current color black) or clears the mask's bits."""
+        ram = self.ram
+        address = (self._static('SCREEN.1') + address) & 0x7FFF
+        if self._static('SCREEN.2'):
+            ram[address] = ram[address] | mask
+        else:
+            ram[address] = ram[address] & ~mask
+
+    def _draw_line(self, x1, y1, x2, y2):
+        """Screen.drawLine(x1, y1, x2, y2): Bresenham, one drawPixel() per pixel."""
+        if not (0 <= x1 <= 511 and 0 <= x2 <= 511 and 0 <= y1 <= 255 and 0 <= y2 <= 255):
+            return None
+        powers_of_two = self._static('SCREEN.0')
+        dx, dy = abs(x2 - x1), abs(y2 - y1)
+        steep = dx < dy
+        if (steep and y2 < y1) or (not steep and x2 < x1):
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        if steep:
+            dx, dy = dy, dx
+            step, other, end, backwards = y1, x1, y2, x1 > x2
+        else:
+            step, other, end, backwards = x1, y1, x2, y1 > y2
+        error = 2 * dy - dx
+        x = None
+        while True:
+            x, y = (other, step) if steep else (step, other)
+            self._update(y * 32 + x // 16, self.ram[(powers_of_two + x % 16) & 0x7FFF])
+            if not step < end:
+                break
+            if error < 0:
+                error += 2 * dy
+            else:
+                error += 2 * (dy - dx)
+                other += -1 if backwards else 1
+            step += 1
+        # The scratch array as drawPixel() leaves it
+        self._divide(x, 16)
+        return 0
+
+    def _draw_rectangle(self, x1, y1, x2, y2):
+        """Screen.drawRectangle(x1, y1, x2, y2): masks for the first and last words of each row."""
+        if x1 > x2 or y1 > y2 or x1 < 0 or x2 > 511 or y1 < 0 or y2 > 255:
+            return None
+        ram = self.ram
+        powers_of_two = self._static('SCREEN.0')
+        first, last = self._divide(x1, 16), self._divide(x2, 16)
+        first_mask = word(~(ram[(powers_of_two + x1 % 16) & 0x7FFF] - 1))
+        last_mask = word(ram[(powers_of_two + x2 % 16 + 1) & 0x7FFF] - 1)
+        words = last - first
+        address = y1 * 32 + first
+        for _ in range(y1, y2 + 1):
+            if words == 0:
+                self._update(address, last_mask & first_mask)
+            else:
+                self._update(address, first_mask)
+                for middle in range(address + 1, address + words):
+                    self._update(middle, -1)
+                self._update(address + words, last_mask)
+            address += 32
+        return 0
+
+
+# For OS trap error exception; does nothing (just for convention)
+class OSTrapError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Jack program, with native OS functions.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--map', help="the program's symbol map (default: <program>.map)")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    arg_parser.add_argument('--only', action='append', metavar='FUNCTION',
+                            help="trap only this function (e.g. Math.multiply; can be repeated)")
+    add_ram_arguments(arg_parser, assignments=False)
+    args = arg_parser.parse_args()
+
+    machine = OSTrapMachine(args.filename, args.map, args.only)
+    machine.run(args.cycles)
+
+    print(f"PC={machine.pc} A={machine.a} D={machine.d} ({machine.cycles} cycles)")
+    for function, calls in sorted(machine.trapped_calls.items()):
+        print(f"{function}: {calls} calls trapped")
+    print_ram(machine, args.dump)
@@ -0,0 +1,186 @@
+###############################################################################
+# 05-computer-architecture/profiler.py
+# ------------------------------------
+# The ProfilingMachine is a BlockMachine that counts how often each ROM
+# address runs, and attributes the cycles to the functions of programs
+# translated by the VM translator (08-vm-program-control), to find where
+# a Jack program spends its time.
+#
+# Functions are found from the labels of the program's symbol map (the .map
+# file written by `assembler.py --map`): the VM translator starts every
+# function with an upper-cased `CLASS.FUNCTION` label, and each function runs
+# up to the next one; the code before the first function (the bootstrap) is
+# reported as `(startup)`.
+#
+# Counts are kept per block (each run of a compiled block runs each of its
+# instructions once), so profiling costs little more than running. Calls and
+# returns are followed through the VM calling convention, on block entries:
+#   - reaching a function's label calls it: its return address is the first
+#     word of the frame the caller pushed (RAM[SP - 5]);
+#   - reaching the return address of the function on top of the call stack,
+#     with SP back below its frame, returns from it.
+# The cycles run under each call stack give the inclusive cycles of the
+# functions (the cycles spent in them and in the functions they call), and
+# the collapsed stacks read by flamegraph tools (`func;func;func cycles`).
+#
+# To run: python profiler.py [--map FILE] [--cycles N] [--top N]
+#                            [--collapsed FILE] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+import os
+from bisect import bisect_right
+from block_compiler import BlockMachine
+from toolchain import SymbolMap
+from toolchain import TreeShaker
+
+
+class ProfilingMachine(BlockMachine):
+    # Entry labels written by the VM translator for each function (see TreeShaker)
+    FUNCTION_LABEL = TreeShaker.FUNCTION_LABEL
+
+    STARTUP = TreeShaker.STARTUP
+
+    _hooked = True
+
+    def __init__(self, program=None, symbols=None):
+        """
+        Arguments:
+        program -- optional program to load (see HackMachine.load())
+        symbols -- the program's labels ({label: address}), or its .map file
+        (by default, the .map file next to the program file)
+        """
+        if symbols is None and isinstance(program, str):
+            symbols = os.path.splitext(program)[0] + '.map'
+        if isinstance(symbols, str):
+            if not os.path.exists(symbols):
+                raise ProfilerError(f"No symbol map {symbols}: assemble the program with --map.")
+            symbols = SymbolMap.load(symbols).labels
+        self.labels = symbols or {}
+        super().__init__(program)
+
+    def load(self, program):
+        """Loads a program into ROM (see BlockMachine.load()) and clears the profile."""
+        super().load(program)
+        entries = sorted((address, label) for label, address in self.labels.items()
+                         if self.FUNCTION_LABEL.match(label))
+        # Function entry addresses (the last label wins where several share an address)
+        self.entries = dict(entries)
+        self._starts = sorted(self.entries)
+        self.reset_profile()
+
+    def reset(self):
+        """Restarts the program (see HackMachine.reset()), with an empty call stack."""
+        super().reset()
+        # Call stack: (function, return address, SP on entry) frames
+        self.stack = [(self.STARTUP, None, None)]
+        # Functions of the call stack, and return address and SP of its top frame
+        self._current = (self.STARTUP,)
+        self._return_address = self._frame_sp = None
+
+    def reset_profile(self):
+        """Clears the counts."""
+        # Number of runs of the block starting at each address / of interpreted runs of each address
+        self.block_counts = [0] * self.ROM_SIZE
+        self.interpreted_counts = [0] * self.ROM_SIZE
+        # Number of calls of each function, and cycles run under each call stack (tuple of functions)
+        self.calls = {}
+        self.stack_cycles = {}
+
+    def function(self, address):
+        """Returns the function the ROM address belongs to."""
+        index = bisect_right(self._starts, address)
+        return self.entries[self._starts[index - 1]] if index else self.STARTUP
+
+    def address_counts(self):
+        """Returns the number of times each ROM address ran (list)."""
+        counts = list(self.interpreted_counts)
+        for start, block in enumerate(self.blocks):
+            if block is not None and self.block_counts[start]:
+                for address in range(start, start + block[1]):
+                    counts[address] += self.block_counts[start]
+        return counts
+
+    def profile(self):
+        """
+        Returns the profile of each function, as a list of (function, calls,
+        self cycles, inclusive cycles) tuples, by decreasing self cycles.
+        """
+        self_cycles = {}
+        for address, count in enumerate(self.address_counts()):
+            if count:
+                function = self.function(address)
+                self_cycles[function] = self_cycles.get(function, 0) + count
+        inclusive_cycles = {}
+        for stack, cycles in self.stack_cycles.items():
+            for function in set(stack):
+                inclusive_cycles[function] = inclusive_cycles.get(function, 0) + cycles
+        functions = set(self_cycles) | set(inclusive_cycles)
+        return sorted(((function, self.calls.get(function, 0), self_cycles.get(function, 0),
+                        inclusive_cycles.get(function, 0)) for function in functions),
+                      key=lambda entry: (-entry[2], -entry[3], entry[0]))
+
+    def report(self, top=None):
+        """Returns the profile report (one line per function, the `top` ones by self cycles)."""
+        total = sum(self.stack_cycles.values()) or 1
+        lines = [f"{'function':<40} {'calls':>9} {'self':>11} {'self %':>7} {'inclusive':>11} {'incl %':>7}"]
+        for function, calls, self_cycles, inclusive_cycles in self.profile()[:top]:
+            lines.append(f"{function:<40} {calls:>9} {self_cycles:>11} {self_cycles / total:>7.1%}"
+                         f" {inclusive_cycles:>11} {inclusive_cycles / total:>7.1%}")
+        lines.append(f"{sum(self.stack_cycles.values())} cycles profiled")
+        return '\n'.join(lines) + '\n'
+
+    def write_collapsed(self, stream):
+        """Writes the collapsed call stacks (`function;function;... cycles` lines) to the stream."""
+        for stack, cycles in sorted(self.stack_cycles.items()):
+            stream.write(f"{';'.join(stack)} {cycles}\n")
+
+    def _enter(self, a, d, pc, block, remaining):
+        """
+        Follows calls and returns, and counts the run of the block (or of the
+        interpreted instruction) about to run (see BlockMachine._enter()).
+        """
+        ram = self.ram
+        if pc == self._return_address and ram[0] < self._frame_sp:
+            self.stack.pop()
+            self._current = self._current[:-1]
+            self._return_address, self._frame_sp = self.stack[-1][1:]
+        elif pc in self.entries:
+            function = self.entries[pc]
+            sp = ram[0]
+            self._return_address, self._frame_sp = ram[(sp - 5) & 0x7FFF], sp
+            self.stack.append((function, self._return_address, sp))
+            self._current += (function,)
+            self.calls[function] = self.calls.get(function, 0) + 1
+
+        if block is not None:
+            self.block_counts[pc] += 1
+            cycles = block[1]
+        else:
+            self.interpreted_counts[pc] += 1
+            cycles = 1
+        self.stack_cycles[self._current] = self.stack_cycles.get(self._current, 0) + cycles
+        return None
+
+
+# For profiler error exception; does nothing (just for convention)
+class ProfilerError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Profiles a Hack program translated from VM code.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--map', help="the program's symbol map (default: <program>.map)")
+    arg_parser.add_argument('--cycles', type=int, default=10000000, help="number of cycles to run (default: 10000000)")
+    arg_parser.add_argument('--top', type=int, default=30, help="number of functions to report (default: 30)")
+    arg_parser.add_argument('--collapsed', metavar='FILE', help="also write the collapsed call stacks to FILE")
+    args = arg_parser.parse_args()
+
+    machine = ProfilingMachine(args.filename, args.map)
+    machine.run(args.cycles)
+    print(machine.report(args.top), end='')
+    if args.collapsed:
+        with open(args.collapsed, 'w') as collapsed_file:
+            machine.write_collapsed(collapsed_file)
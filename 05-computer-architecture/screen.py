@@ -0,0 +1,138 @@
+###############################################################################
+# 05-computer-architecture/screen.py
+# ----------------------------------
+# The Screen renders the Hack screen memory map (RAM 0x4000-0x5FFF) of a
+# Python Hack machine as a 512 x 256 black and white bitmap, headlessly, and
+# writes it as PBM or PNG frames.
+#
+# Each of the 256 rows of pixels is 32 words; the pixel at column c of a row
+# is bit c % 16 of word c // 16 (bit 0 is leftmost), 1 for black. Words are
+# turned into pixels with NumPy's unpackbits (bitorder='little').
+#
+# The screen keeps the words it last rendered: on each frame, the dirty words
+# (those written with a different value since the last frame) are found by
+# comparing them with the RAM, and only the rows holding dirty words are
+# rendered again, and a frame where nothing changed is known without rendering
+# anything (the recording below only writes the frames that changed).
+# Nothing has to be tracked while the machine runs, so the engines run at
+# full speed between frames.
+#
+# Requires NumPy.
+#
+# To run: python screen.py [--cycles N] [--every N] [--set ADDRESS=VALUE ...]
+#                          [--output PATTERN] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+from block_compiler import BlockMachine
+from hack_machine import HackMachine
+from hack_machine import add_ram_arguments
+from hack_machine import set_ram
+
+
+class Screen:
+    WIDTH = 512
+    HEIGHT = 256
+    ROW_WORDS = WIDTH // 16     # Words per row of pixels
+    WORDS = HEIGHT * ROW_WORDS  # 8K words
+
+    def __init__(self, ram):
+        """
+        Arguments: ram -- the RAM of the machine (the `ram` array('h') of a
+        HackMachine, or any buffer of 16-bit words covering the screen)
+        """
+        memory = np.frombuffer(ram, dtype=np.uint16)
+        if len(memory) < HackMachine.SCREEN + self.WORDS:
+            raise ScreenError(f"The RAM does not cover the screen ({len(memory)} words).")
+        # The screen words of the RAM (a view: it follows the machine's writes)
+        self.words = memory[HackMachine.SCREEN:HackMachine.SCREEN + self.WORDS]
+        # The words as of the last frame, and their pixels (1 = black)
+        self.rendered = np.zeros(self.WORDS, dtype=np.uint16)
+        self.bitmap = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        # Number of frames / of rows rendered so far
+        self.frames = 0
+        self.rows_rendered = 0
+
+    def dirty_words(self):
+        """Returns the indices of the screen words that changed since the last frame (array)."""
+        return np.flatnonzero(self.words != self.rendered)
+
+    def update(self):
+        """
+        Renders a frame: the rows holding dirty words.
+
+        Returns: the indices of the rows rendered again (array)
+        """
+        dirty = self.dirty_words()
+        rows = np.unique(dirty // self.ROW_WORDS)
+        if len(rows):
+            self.rendered[dirty] = self.words[dirty]
+            # Little-endian words, bits from least significant: the pixels from left to right
+            words = self.rendered.reshape(self.HEIGHT, self.ROW_WORDS)[rows].astype('<u2')
+            self.bitmap[rows] = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+        self.frames += 1
+        self.rows_rendered += len(rows)
+        return rows
+
+    def write_pbm(self, stream):
+        """Writes the last frame as a binary PBM image (P4) to the stream (binary)."""
+        stream.write(f"P4\n{self.WIDTH} {self.HEIGHT}\n".encode())
+        # PBM: 1 is black, leftmost pixel in the most significant bit
+        stream.write(np.packbits(self.bitmap, axis=1).tobytes())
+
+    def write_png(self, stream):
+        """Writes the last frame as a 1-bit grayscale PNG image to the stream (binary)."""
+        # Grayscale: 0 is black; each row is preceded by its filter type (0: none)
+        pixels = np.packbits(1 - self.bitmap, axis=1)
+        data = np.hstack((np.zeros((self.HEIGHT, 1), dtype=np.uint8), pixels)).tobytes()
+        stream.write(b'\x89PNG\r\n\x1a\n')
+        for chunk_type, chunk in ((b'IHDR', struct.pack('>IIBBBBB', self.WIDTH, self.HEIGHT, 1, 0, 0, 0, 0)),
+                                  (b'IDAT', zlib.compress(data)),
+                                  (b'IEND', b'')):
+            stream.write(struct.pack('>I', len(chunk)) + chunk_type + chunk)
+            stream.write(struct.pack('>I', zlib.crc32(chunk_type + chunk)))
+
+    def write(self, filename):
+        """Writes the last frame to a .pbm or .png file (by extension)."""
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in ('.pbm', '.png'):
+            raise ScreenError(f"Cannot write a {extension} image: use .pbm or .png.")
+        with open(filename, 'wb') as image_file:
+            self.write_pbm(image_file) if extension == '.pbm' else self.write_png(image_file)
+
+
+# For screen error exception; does nothing (just for convention)
+class ScreenError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Hack program and records its screen.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    arg_parser.add_argument('--every', type=int, default=100000,
+                            help="cycles between frames (default: 100000); frames are only written when the screen changed")
+    add_ram_arguments(arg_parser, dump=False)
+    arg_parser.add_argument('--output', metavar='PATTERN',
+                            help="frame filenames, formatted with the cycle number (.pbm or .png; "
+                                 "default: <program>-{cycle:09d}.png)")
+    args = arg_parser.parse_args()
+
+    output = args.output or os.path.splitext(args.filename)[0] + '-{cycle:09d}.png'
+    machine = BlockMachine(args.filename)
+    set_ram(machine, args.set)
+    screen = Screen(machine.ram)
+
+    written = 0
+    while machine.cycles < args.cycles:
+        machine.run(min(args.every, args.cycles - machine.cycles))
+        if len(screen.update()):
+            screen.write(output.format(cycle=machine.cycles))
+            written += 1
+    print(f"{written} frames written ({screen.frames} frames, {screen.rows_rendered} rows rendered)", file=sys.stderr)
@@ -0,0 +1,385 @@
+###############################################################################
+# 05-computer-architecture/script_runner.py
+# -----------------------------------------
+# The ScriptRunner runs the test scripts (.tst) of the Hack programs headlessly
+# on a Python Hack machine, and compares their output with the expected
+# output (.cmp), as the book's CPU emulator and hardware simulator do.
+#
+# The supported subset of the test script language covers:
+#   - CPU emulator scripts (04, 07, 08): `load <program>.hack|.asm`, with the
+#     variables RAM[i], A, D and PC;
+#   - hardware simulator scripts of the Computer chip (05): `load Computer.hdl`
+#     then `ROM32K load <program>.hack`, with the variables RAM16K[i],
+#     ARegister[], DRegister[], PC[] and reset;
+#   - the commands output-file, compare-to, output-list, output, set, tick,
+#     tock, ticktock, echo, clear-echo and `repeat N { ... }` (a repeat of
+#     clock commands only runs the machine N cycles at once).
+# Scripts of the other chips, of the VM emulator, and interactive scripts
+# (`repeat { ... }` forever) are skipped. Programs in .asm are assembled
+# in memory with 06-assembler's InMemoryAssembler first (see toolchain.py).
+#
+# The scripts load their program from their own directory, or from the
+# directory above (04-machine-language keeps its programs there).
+# Output lines are compared with the .cmp lines whatever their line endings.
+#
+# Scripts (.tst files, or directories searched recursively) are run in a pool
+# of worker processes, like the programs of 06-assembler/batch.py.
+#
+# To run: python script_runner.py [--jobs N] [--out] <script>.tst|<directory> ...
+#
+###############################################################################
+
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from block_compiler import BlockMachine
+from hack_machine import word
+from toolchain import assemble
+
+# Script tokens: quoted strings, punctuation, and words
+_TOKEN = re.compile(r'"[^"]*"|[{},;!]|[^\s{},;!"]+')
+_COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+# Output-list entry: variable%<format><left padding>.<width>.<right padding>
+_OUTPUT_FORMAT = re.compile(r'^(.+)%([BDXS])(\d+)\.(\d+)\.(\d+)$')
+_MEMORY_VARIABLE = re.compile(r'^(RAM|RAM16K)\[(\d+)\]$')
+
+# Commands that only clock the machine
+_CLOCK_COMMANDS = ({'tick'}, {'tock'}, {'ticktock'})
+
+# Register variables: CPU emulator names / Computer chip parts
+_REGISTERS = {
+    'A': 'a', 'ARegister[]': 'a', 'ARegister[0]': 'a',
+    'D': 'd', 'DRegister[]': 'd', 'DRegister[0]': 'd',
+    'PC': 'pc', 'PC[]': 'pc', 'PC[0]': 'pc',
+}
+
+
+def _run_script(filename, write_output):
+    """
+    Runs one script in a worker process.
+
+    Returns: (filename, seconds, status, message) -- status is 'passed',
+    'failed' (with the first mismatch), 'skipped' (unsupported script, with
+    the reason) or 'error'
+    """
+    start = time.perf_counter()
+    try:
+        script = Script(filename)
+        script.run()
+        if write_output and script.output_file:
+            script.write_output()
+        mismatch = script.compare()
+        status, message = ('passed', None) if mismatch is None else ('failed', mismatch)
+    except UnsupportedScript as exception:
+        status, message = 'skipped', str(exception)
+    except Exception as exception:
+        status, message = 'error', f"{type(exception).__name__}: {exception}"
+    return filename, time.perf_counter() - start, status, message
+
+
+class Script:
+
+    def __init__(self, filename):
+        """Reads and parses a test script."""
+        self.filename = filename
+        self._directory = os.path.dirname(os.path.abspath(filename))
+        with open(filename) as script_file:
+            tokens = _TOKEN.findall(_COMMENT.sub(' ', script_file.read()))
+        self.commands = self._parse(tokens, 0, top_level=True)[0]
+
+        self.machine = None
+        self.computer = False   # Hardware simulator script of the Computer chip
+        self.reset = 0
+        self.time = '0'
+        self.output_file = None
+        self.compare_to = None
+        self.output_list = []
+        self.output = []        # Output lines
+
+    def _parse(self, tokens, index, top_level=False):
+        """
+        Parses the commands from tokens[index] up to the end of the block.
+
+        Returns: (commands, index after the block) -- each command is a list of
+        words, or a ('repeat', count, commands) tuple
+        """
+        commands, words = [], []
+        while index < len(tokens):
+            token = tokens[index]
+            index += 1
+            if token in (',', ';', '!'):
+                if words:
+                    commands.append(words)
+                    words = []
+            elif token == '{':
+                if not words or words[0] != 'repeat':
+                    raise UnsupportedScript(f"unsupported block: {' '.join(words)} {{")
+                if len(words) == 1:
+                    raise UnsupportedScript("interactive script (repeat forever)")
+                body, index = self._parse(tokens, index)
+                commands.append(('repeat', int(words[1]), body))
+                words = []
+            elif token == '}':
+                if top_level:
+                    raise ScriptRunnerError(f"{self.filename}: unbalanced '}}'.")
+                break
+            else:
+                words.append(token)
+        if words:
+            commands.append(words)
+        return commands, index
+
+    def run(self):
+        """Runs the script. Returns: the output lines"""
+        self._run_commands(self.commands)
+        return self.output
+
+    def _run_commands(self, commands):
+        """Runs a block of commands."""
+        for command in commands:
+            if isinstance(command, tuple):
+                _, count, body = command
+                if (self.machine is not None and self.reset == 0 and body[-1] != ['tick']
+                        and all(set(words) in _CLOCK_COMMANDS for words in body)):
+                    # Only clocks the machine: run all the cycles at once
+                    cycles = count * sum(words[0] != 'tick' for words in body)
+                    self.machine.run(cycles)
+                    self.time = str(int(self.time.rstrip('+')) + cycles)
+                else:
+                    for _ in range(count):
+                        self._run_commands(body)
+            else:
+                self._run_command(command)
+
+    def _run_command(self, words):
+        """Runs a single command."""
+        name, arguments = words[0], words[1:]
+        if name == 'load':
+            self._load(arguments[0] if arguments else '')
+        elif name == 'ROM32K' and arguments[:1] == ['load']:
+            self._load_program(arguments[1])
+        elif name == 'output-file':
+            self.output_file = os.path.join(self._directory, arguments[0])
+        elif name == 'compare-to':
+            self.compare_to = os.path.join(self._directory, arguments[0])
+        elif name == 'output-list':
+            self.output_list = [self._output_format(entry) for entry in arguments]
+            self.output.append(self._header())
+        elif name == 'output':
+            self.output.append(self._row())
+        elif name == 'set':
+            self._set(arguments[0], self._parse_value(arguments[1]))
+        elif name in ('tick', 'tock', 'ticktock'):
+            self._clock(name)
+        elif name in ('echo', 'clear-echo'):
+            pass
+        else:
+            raise UnsupportedScript(f"unsupported command: {' '.join(words)}")
+
+    def _load(self, target):
+        """Runs the `load` command: a Hack program, or the Computer chip."""
+        if target == 'Computer.hdl':
+            self.computer = True
+            self.machine = BlockMachine()
+        elif target.lower().endswith('.hdl'):
+            raise UnsupportedScript(f"chip test ({target})")
+        elif target.lower().endswith(('.hack', '.asm')):
+            self._load_program(target)
+        else:
+            raise UnsupportedScript("VM emulator script")
+
+    def _load_program(self, name):
+        """Loads a .hack or .asm program (found next to the script or in the directory above)."""
+        for directory in (self._directory, os.path.dirname(self._directory)):
+            filename = os.path.join(directory, name)
+            if os.path.exists(filename):
+                break
+        else:
+            raise ScriptRunnerError(f"{self.filename}: program {name} not found.")
+        if filename.lower().endswith('.asm'):
+            self.machine = BlockMachine(assemble(filename))
+        elif self.machine is None:
+            self.machine = BlockMachine(filename)
+        else:
+            self.machine.load(filename)
+
+    def _clock(self, name):
+        """Runs a clock command: the machine executes an instruction on each tock."""
+        if name == 'tick':
+            self.time += '+'
+            return
+        self.machine.run(1)
+        if self.reset:
+            self.machine.pc = 0
+        self.time = str(int(self.time.rstrip('+')) + 1)
+
+    @staticmethod
+    def _parse_value(text):
+        """Parses a script value: decimal, or %B (binary), %X (hexadecimal), %D (decimal)."""
+        if text[:2] in ('%B', '%X', '%D'):
+            value = int(text[2:], {'%B': 2, '%X': 16, '%D': 10}[text[:2]])
+        else:
+            value = int(text)
+        return word(value)
+
+    def _set(self, variable, value):
+        """Runs the `set` command."""
+        memory = _MEMORY_VARIABLE.match(variable)
+        if memory:
+            self.machine.ram[int(memory.group(2))] = value
+        elif variable in _REGISTERS:
+            setattr(self.machine, _REGISTERS[variable], value & 0x7FFF if variable.startswith('PC') else value)
+        elif variable == 'reset' and self.computer:
+            self.reset = value
+        else:
+            raise UnsupportedScript(f"unsupported variable: {variable}")
+
+    def _get(self, variable):
+        """Returns the value of a variable (int, or str for time)."""
+        memory = _MEMORY_VARIABLE.match(variable)
+        if memory:
+            return self.machine.ram[int(memory.group(2))]
+        if variable in _REGISTERS:
+            return getattr(self.machine, _REGISTERS[variable])
+        if variable == 'reset':
+            return self.reset
+        if variable == 'time':
+            return self.time
+        raise UnsupportedScript(f"unsupported variable: {variable}")
+
+    @staticmethod
+    def _output_format(entry):
+        """Parses an output-list entry. Returns: (variable, format, left padding, width, right padding)"""
+        match = _OUTPUT_FORMAT.match(entry)
+        if not match:
+            raise UnsupportedScript(f"unsupported output format: {entry}")
+        variable, output_format, left, width, right = match.groups()
+        return variable, output_format, int(left), int(width), int(right)
+
+    def _header(self):
+        """Returns the header line of the output list: each variable centered in its column."""
+        columns = []
+        for variable, _, left, width, right in self.output_list:
+            size = left + width + right
+            name = variable[:size]
+            padding = (size - len(name)) // 2
+            columns.append(' ' * padding + name + ' ' * (size - padding - len(name)))
+        return '|' + '|'.join(columns) + '|'
+
+    def _row(self):
+        """Returns the output line of the current values of the output list."""
+        columns = []
+        for variable, output_format, left, width, right in self.output_list:
+            value = self._get(variable)
+            if output_format == 'S':
+                text = f"{value:<{width}}"
+            elif output_format == 'D':
+                text = f"{value:>{width}}"
+            else:
+                digits = format(value & 0xFFFF, '016b' if output_format == 'B' else '04X')
+                text = f"{digits[-width:]:>{width}}"
+            columns.append(' ' * left + text + ' ' * right)
+        return '|' + '|'.join(columns) + '|'
+
+    def compare(self):
+        """
+        Compares the output with the compare-to file.
+
+        Returns: None if they match, or the description of the first mismatch
+        """
+        if self.compare_to is None:
+            raise UnsupportedScript("no compare-to file")
+        with open(self.compare_to) as compare_file:
+            expected = [line.rstrip() for line in compare_file.read().splitlines()]
+        expected = [line for line in expected if line]
+        for line_number, (expected_line, line) in enumerate(zip(expected, self.output), 1):
+            if line != expected_line:
+                return f"line {line_number}: expected {expected_line!r}, got {line!r}"
+        if len(expected) != len(self.output):
+            return f"{len(self.output)} lines output, {len(expected)} expected"
+        return None
+
+    def write_output(self):
+        """Writes the output lines to the script's output file."""
+        with open(self.output_file, 'w') as output_file:
+            output_file.write('\n'.join(self.output) + '\n')
+
+
+class ScriptRunner:
+
+    def __init__(self, workers=None, write_output=False):
+        """
+        Arguments:
+        workers -- number of worker processes (default: number of CPUs)
+        write_output -- whether to write each script's output file (.out)
+        """
+        self._workers = workers or os.cpu_count()
+        self._write_output = write_output
+
+    def run(self, paths):
+        """
+        Runs every script found in the paths (.tst files or directories).
+
+        Returns: a list of (filename, seconds, status, message) results, in the
+        order the scripts were found
+        """
+        filenames = self.find_scripts(paths)
+        if not filenames:
+            return []
+        if self._workers == 1:
+            return [_run_script(filename, self._write_output) for filename in filenames]
+        with multiprocessing.Pool(min(self._workers, len(filenames))) as pool:
+            return pool.starmap(_run_script, ((filename, self._write_output) for filename in filenames),
+                                chunksize=1)
+
+    @staticmethod
+    def find_scripts(paths):
+        """Returns the .tst files among the paths and in the directories (recursively), sorted."""
+        filenames = []
+        for path in paths:
+            if os.path.isdir(path):
+                for directory, _, names in os.walk(path):
+                    filenames.extend(os.path.join(directory, name) for name in sorted(names)
+                                     if name.lower().endswith('.tst'))
+            else:
+                filenames.append(path)
+        return sorted(filenames)
+
+    @staticmethod
+    def report(results, seconds=None):
+        """Returns the report of a run: one line per script, then the totals."""
+        lines = []
+        for filename, elapsed, status, message in results:
+            lines.append(f"{filename:<70} {status:<8} {elapsed * 1000:9.1f} ms{f'  {message}' if message else ''}")
+        counts = {status: sum(result[2] == status for result in results)
+                  for status in ('passed', 'failed', 'error', 'skipped')}
+        lines.append(f"{len(results)} scripts: " + ', '.join(f"{count} {status}" for status, count in counts.items())
+                     + (f" in {seconds:.3f} s" if seconds else ''))
+        return '\n'.join(lines) + '\n'
+
+
+# For script runner error exception; does nothing (just for convention)
+class ScriptRunnerError(Exception):
+    pass
+
+
+# For scripts outside of the supported subset; does nothing (just for convention)
+class UnsupportedScript(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs Hack test scripts (.tst) and compares their output.")
+    arg_parser.add_argument('paths', nargs='+', help=".tst scripts or directories containing them")
+    arg_parser.add_argument('--jobs', type=int, default=None, metavar='N',
+                            help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument('--out', action='store_true', help="write the output files (.out) of the scripts")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    results = ScriptRunner(args.jobs, args.out).run(args.paths)
+    print(ScriptRunner.report(results, time.perf_counter() - start), end='')
+    if any(status in ('failed', 'error') for _, _, status, _ in results):
+        raise SystemExit(1)
@@ -0,0 +1,131 @@
+###############################################################################
+# 05-computer-architecture/snapshot.py
+# ------------------------------------
+# Snapshots save the state of a Python Hack machine to a file, and restore it
+# almost instantly: a program can be brought to an interesting state once
+# (e.g. a Jack game past its OS initialization), and every test or benchmark
+# run can start from that warm checkpoint instead of from reset.
+#
+# A snapshot file is a 64-byte header followed by the 32K words of RAM:
+#   - header: magic ('HACKSNAP'), version, PC, A, D, cycle count and the
+#     SHA-1 hash of the ROM the machine was running (see rom_hash());
+#   - RAM: signed 16-bit words, little-endian (as the .rom images).
+# Snapshot files are memory-mapped: restoring one copies its RAM pages straight
+# into the machine's RAM, and a Snapshot object kept open restores its state
+# again and again (e.g. before each test case) without reading the file.
+# The ROM hash is checked on restore, so that a snapshot is never restored
+# into a machine running another program.
+#
+# To run: python snapshot.py [--from SNAPSHOT] [--cycles N] [--save SNAPSHOT]
+#                            [--set ADDRESS=VALUE ...] [--dump START[:END]]
+#                            <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+from block_compiler import BlockMachine
+from hack_machine import HackMachine
+from hack_machine import add_ram_arguments
+from hack_machine import print_ram
+from hack_machine import set_ram
+from toolchain import Rom
+
+
+def rom_hash(machine):
+    """Returns the SHA-1 hash (bytes) of the machine's ROM words, little-endian."""
+    rom = machine.rom
+    if sys.byteorder != Rom.BYTEORDER:
+        rom = array('H', rom)
+        rom.byteswap()
+    return hashlib.sha1(rom).digest()
+
+
+class Snapshot:
+    MAGIC = b'HACKSNAP'
+    VERSION = 1
+    # magic, version, PC, A, D, cycles, ROM hash (padded to HEADER_SIZE)
+    HEADER = struct.Struct('<8sHHhhQ20s')
+    HEADER_SIZE = 64
+    SIZE = HEADER_SIZE + 2 * HackMachine.RAM_SIZE
+
+    def __init__(self, filename):
+        """Opens (memory-maps) a snapshot file."""
+        with open(filename, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) != self.SIZE:
+            self.close()
+            raise SnapshotError(f"{filename} is not a snapshot ({self.SIZE} bytes expected).")
+        magic, version, self.pc, self.a, self.d, self.cycles, self.rom_hash = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise SnapshotError(f"{filename} is not a version {self.VERSION} snapshot.")
+        self.filename = filename
+
+    @classmethod
+    def save(cls, machine, filename):
+        """Saves the state of the machine (RAM and registers) to a snapshot file."""
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, machine.pc, machine.a, machine.d, machine.cycles,
+                                 rom_hash(machine))
+        ram = machine.ram
+        if sys.byteorder != Rom.BYTEORDER:
+            ram = array('h', ram)
+            ram.byteswap()
+        with open(filename, 'wb') as snapshot_file:
+            snapshot_file.write(header.ljust(cls.HEADER_SIZE, b'\0'))
+            snapshot_file.write(ram)
+
+    def restore(self, machine, check_rom=True):
+        """
+        Restores the snapshot's state (RAM and registers) into the machine,
+        which must have the snapshot's program loaded (unless check_rom is False).
+        The machine's RAM is updated in place.
+        """
+        if check_rom and rom_hash(machine) != self.rom_hash:
+            raise SnapshotError(f"{self.filename} was not taken with the program loaded in this machine.")
+        ram = memoryview(machine.ram).cast('B')
+        ram[:] = self._mmap[self.HEADER_SIZE:]
+        if sys.byteorder != Rom.BYTEORDER:
+            machine.ram.byteswap()
+        machine.pc, machine.a, machine.d, machine.cycles = self.pc, self.a, self.d, self.cycles
+
+    def close(self):
+        """Closes the snapshot file."""
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+# For snapshot error exception; does nothing (just for convention)
+class SnapshotError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a Hack program from / to a snapshot.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--from', dest='start', metavar='SNAPSHOT', help="restore the snapshot before running")
+    arg_parser.add_argument('--cycles', type=int, default=0, help="number of cycles to run (default: 0)")
+    arg_parser.add_argument('--save', metavar='SNAPSHOT', help="save a snapshot after running")
+    add_ram_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    machine = BlockMachine(args.filename)
+    if args.start:
+        with Snapshot(args.start) as snapshot:
+            snapshot.restore(machine)
+    set_ram(machine, args.set)
+    machine.run(args.cycles)
+    if args.save:
+        Snapshot.save(machine, args.save)
+
+    print(f"PC={machine.pc} A={machine.a} D={machine.d} ({machine.cycles} cycles)")
+    print_ram(machine, args.dump)
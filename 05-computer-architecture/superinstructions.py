@@ -0,0 +1,408 @@
+###############################################################################
+# 05-computer-architecture/superinstructions.py
+# ---------------------------------------------
+# The FusedMachine is a DecodedMachine that runs the instruction sequences
+# written by the VM translator (08-vm-program-control's CodeWriter) as
+# superinstructions: one Python function per sequence instead of one
+# decoded op per instruction.
+#
+# The CodeWriter writes each VM command with a fixed template, e.g.
+#     push D:      @SP, M=M+1, A=M-1, M=D
+#     pop D:       @SP, AM=M-1, D=M
+#     add:         pop D, pop A, D=A+D, push D
+#     call f n:    @RET, D=A, push D, @LCL, D=M, push D, ... @f, 0;JMP
+# When a program is loaded, the ROM is searched for these templates (see
+# TEMPLATES; `@*` matches any A-instruction, whose value becomes a parameter
+# of the superinstruction, e.g. the constant pushed or the function called).
+# Each match becomes a superinstruction at the address where it starts (the
+# longest template wins), built from the template's parameters:
+#     def push_constant(ram, a, d):
+#         sp = ram[0]
+#         ram[0] = sp + 1 (wrapped)
+#         ram[sp] = 7
+#         return sp, 7, next_pc
+# A superinstruction does what its instructions would (same RAM writes, in
+# the same order, and same A, D and PC at the end) and counts as many cycles.
+# Jumps into the middle of a template are fine: the instructions from there
+# on run one by one (only the template's first address is fused).
+#
+# The machine counts the cycles run fused (`fused_cycles`), to report how
+# much of the dynamic instruction stream the templates cover.
+#
+# To run: python superinstructions.py [--cycles N] <program>.hack|.rom
+#
+###############################################################################
+
+import argparse
+import timeit
+from decoded_machine import DecodedMachine
+from hack_machine import word
+from toolchain import Code
+from toolchain import SymbolTable
+
+
+# Predefined symbols of the templates (SP, LCL, ..., R13, R14)
+_SYMBOLS = SymbolTable()
+
+
+def _pattern(instruction):
+    """
+    Returns the instruction word of a template instruction, or None for `@*`
+    (any A-instruction).
+    """
+    if instruction.startswith('@'):
+        symbol = instruction[1:]
+        if symbol == '*':
+            return None
+        return int(symbol) if symbol.isdigit() else _SYMBOLS.get_address(symbol)
+    dest, _, rest = instruction.rpartition('=')
+    comp, _, jump = rest.partition(';')
+    return int(f"111{Code.comp(comp)}{Code.dest(dest or None)}{Code.jump(jump or None)}", 2)
+
+
+# Superinstructions: each function takes the template's parameters and the
+# address following the template, and returns the superinstruction, a
+# function of (ram, a, d) returning (a, d, pc)
+
+def _push_d(next_pc):
+    def push_d(ram, a, d):
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = d
+        return sp, d, next_pc
+    return push_d
+
+
+def _push_value(value):
+    def build(next_pc):
+        def push_value(ram, a, d):
+            sp = ram[0]
+            ram[0] = ((sp + 32769) & 65535) - 32768
+            ram[sp & 32767] = value
+            return sp, d, next_pc
+        return push_value
+    return build
+
+
+def _pop_d(next_pc):
+    def pop_d(ram, a, d):
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        return sp, ram[sp & 32767], next_pc
+    return pop_d
+
+
+def _pop_a(next_pc):
+    def pop_a(ram, a, d):
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        return ram[sp & 32767], d, next_pc
+    return pop_a
+
+
+def _binary(operation):
+    def build(next_pc):
+        def binary(ram, a, d):
+            sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+            d = ram[sp & 32767]
+            sp = ram[0] = ((sp + 32767) & 65535) - 32768
+            d = operation(ram[sp & 32767], d)
+            ram[0] = ((sp + 32769) & 65535) - 32768
+            ram[sp & 32767] = d
+            return sp, d, next_pc
+        return binary
+    return build
+
+
+def _compare(condition):
+    def build(target, next_pc):
+        jump_pc = target & 32767
+        def compare(ram, a, d):
+            sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+            d = ram[sp & 32767]
+            sp = ram[0] = ((sp + 32767) & 65535) - 32768
+            d = ((ram[sp & 32767] - d + 32768) & 65535) - 32768
+            return target, d, jump_pc if condition(d) else next_pc
+        return compare
+    return build
+
+
+def _unary(operation):
+    def build(next_pc):
+        def unary(ram, a, d):
+            a = ((ram[0] + 32767) & 65535) - 32768
+            ram[a & 32767] = operation(ram[a & 32767])
+            return a, d, next_pc
+        return unary
+    return build
+
+
+def _push_constant(value, next_pc):
+    def push_constant(ram, a, d):
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = value
+        return sp, value, next_pc
+    return push_constant
+
+
+def _push_static(address, next_pc):
+    address &= 32767
+    def push_static(ram, a, d):
+        d = ram[address]
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = d
+        return sp, d, next_pc
+    return push_static
+
+
+def _push_segment(index, base, next_pc):
+    base &= 32767
+    def push_segment(ram, a, d):
+        d = ram[(ram[base] + index) & 32767]
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = d
+        return sp, d, next_pc
+    return push_segment
+
+
+def _push_fixed(index, base, next_pc):
+    address = (base + index) & 32767
+    def push_fixed(ram, a, d):
+        d = ram[address]
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = d
+        return sp, d, next_pc
+    return push_fixed
+
+
+def _pop_segment(index, base, next_pc):
+    base &= 32767
+    def pop_segment(ram, a, d):
+        ram[13] = ((ram[base] + index + 32768) & 65535) - 32768
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        d = ram[sp & 32767]
+        a = ram[13]
+        ram[a & 32767] = d
+        return a, d, next_pc
+    return pop_segment
+
+
+def _pop_fixed(index, base, next_pc):
+    address = ((base + index + 32768) & 65535) - 32768
+    def pop_fixed(ram, a, d):
+        ram[13] = address
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        d = ram[sp & 32767]
+        a = ram[13]
+        ram[a & 32767] = d
+        return a, d, next_pc
+    return pop_fixed
+
+
+def _pop_static(address, next_pc):
+    def pop_static(ram, a, d):
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        d = ram[address & 32767] = ram[sp & 32767]
+        return address, d, next_pc
+    return pop_static
+
+
+def _if_goto(target, next_pc):
+    jump_pc = target & 32767
+    def if_goto(ram, a, d):
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        d = ram[sp & 32767]
+        return target, d, jump_pc if d else next_pc
+    return if_goto
+
+
+def _goto(target, next_pc):
+    jump_pc = target & 32767
+    def goto(ram, a, d):
+        return target, d, jump_pc
+    return goto
+
+
+def _locals_loop(target, next_pc):
+    jump_pc = target & 32767
+    def locals_loop(ram, a, d):
+        d = ram[13] = ((ram[13] + 32767) & 65535) - 32768
+        return target, d, jump_pc if d < 0 else next_pc
+    return locals_loop
+
+
+def _call(return_address, num_args, function, next_pc):
+    jump_pc = function & 32767
+    frame_size = ((num_args + 5 + 32768) & 65535) - 32768
+    def call(ram, a, d):
+        sp = ram[0]
+        ram[0] = ((sp + 32769) & 65535) - 32768
+        ram[sp & 32767] = return_address
+        for pointer in (1, 2, 3, 4):
+            # LCL, ARG, THIS and THAT
+            value = ram[pointer]
+            sp = ram[0]
+            ram[0] = ((sp + 32769) & 65535) - 32768
+            ram[sp & 32767] = value
+        ram[2] = ((ram[0] - frame_size + 32768) & 65535) - 32768
+        d = ram[1] = ram[0]
+        return function, d, jump_pc
+    return call
+
+
+def _return(next_pc):
+    def return_(ram, a, d):
+        ram[14] = ram[(ram[1] - 5) & 32767]
+        sp = ram[0] = ((ram[0] + 32767) & 65535) - 32768
+        ram[ram[2] & 32767] = ram[sp & 32767]
+        ram[0] = ((ram[2] + 32769) & 65535) - 32768
+        ram[13] = ram[1]
+        for pointer in (4, 3, 2, 1):
+            frame = ram[13] = ((ram[13] + 32767) & 65535) - 32768
+            d = ram[pointer] = ram[frame & 32767]
+        a = ram[14]
+        return a, d, a & 32767
+    return return_
+
+
+_PUSH_D = ('@SP', 'M=M+1', 'A=M-1', 'M=D')
+_POP_D = ('@SP', 'AM=M-1', 'D=M')
+_POP_A = ('@SP', 'AM=M-1', 'A=M')
+
+# CodeWriter templates: name -> (instructions, superinstruction builder)
+TEMPLATES = {
+    'call': (('@*', 'D=A', *_PUSH_D,
+              *(instruction for pointer in ('LCL', 'ARG', 'THIS', 'THAT') for instruction in (f'@{pointer}', 'D=M', *_PUSH_D)),
+              '@*', 'D=A', '@5', 'D=A+D', '@SP', 'D=M-D', '@ARG', 'M=D', '@SP', 'D=M', '@LCL', 'M=D', '@*', '0;JMP'),
+             _call),
+    'return': (('@5', 'D=A', '@LCL', 'A=M-D', 'D=M', '@R14', 'M=D', *_POP_D, '@ARG', 'A=M', 'M=D',
+                '@ARG', 'D=M+1', '@SP', 'M=D', '@LCL', 'D=M', '@R13', 'M=D',
+                *(instruction for pointer in ('THAT', 'THIS', 'ARG', 'LCL')
+                  for instruction in ('@R13', 'AM=M-1', 'D=M', f'@{pointer}', 'M=D')),
+                '@R14', 'A=M', '0;JMP'),
+               _return),
+    'pop segment': (('@*', 'D=A', '@*', 'D=M+D', '@R13', 'M=D', *_POP_D, '@R13', 'A=M', 'M=D'), _pop_segment),
+    'pop temp/pointer': (('@*', 'D=A', '@*', 'D=A+D', '@R13', 'M=D', *_POP_D, '@R13', 'A=M', 'M=D'), _pop_fixed),
+    'add': ((*_POP_D, *_POP_A, 'D=A+D', *_PUSH_D), _binary(lambda x, y: word(x + y))),
+    'sub': ((*_POP_D, *_POP_A, 'D=A-D', *_PUSH_D), _binary(lambda x, y: word(x - y))),
+    'and': ((*_POP_D, *_POP_A, 'D=A&D', *_PUSH_D), _binary(lambda x, y: x & y)),
+    'or': ((*_POP_D, *_POP_A, 'D=A|D', *_PUSH_D), _binary(lambda x, y: x | y)),
+    'eq': ((*_POP_D, *_POP_A, 'D=A-D', '@*', 'D;JEQ'), _compare(lambda out: out == 0)),
+    'gt': ((*_POP_D, *_POP_A, 'D=A-D', '@*', 'D;JGT'), _compare(lambda out: out > 0)),
+    'lt': ((*_POP_D, *_POP_A, 'D=A-D', '@*', 'D;JLT'), _compare(lambda out: out < 0)),
+    'push segment': (('@*', 'D=A', '@*', 'A=M+D', 'D=M', *_PUSH_D), _push_segment),
+    'push temp/pointer': (('@*', 'D=A', '@*', 'A=A+D', 'D=M', *_PUSH_D), _push_fixed),
+    'push constant': (('@*', 'D=A', *_PUSH_D), _push_constant),
+    'push static': (('@*', 'D=M', *_PUSH_D), _push_static),
+    'pop static': ((*_POP_D, '@*', 'M=D'), _pop_static),
+    'if-goto': ((*_POP_D, '@*', 'D;JNE'), _if_goto),
+    'locals loop': (('@R13', 'MD=M-1', '@*', 'D;JLT'), _locals_loop),
+    'push D': (_PUSH_D, _push_d),
+    'push false': (('@SP', 'M=M+1', 'A=M-1', 'M=0'), _push_value(0)),
+    'push true': (('@SP', 'M=M+1', 'A=M-1', 'M=-1'), _push_value(-1)),
+    'neg': (('@SP', 'A=M-1', 'M=-M'), _unary(lambda x: word(-x))),
+    'not': (('@SP', 'A=M-1', 'M=!M'), _unary(lambda x: ~x)),
+    'pop D': (_POP_D, _pop_d),
+    'pop A': (_POP_A, _pop_a),
+    'goto': (('@*', '0;JMP'), _goto),
+}
+
+
+class FusedMachine(DecodedMachine):
+    # Templates as (name, instruction words (None for `@*`), builder), longest first
+    _TEMPLATES = sorted(((name, tuple(map(_pattern, instructions)), builder)
+                         for name, (instructions, builder) in TEMPLATES.items()),
+                        key=lambda template: -len(template[1]))
+
+    def load(self, program):
+        """Loads a program into ROM (see DecodedMachine.load()) and fuses its templates."""
+        super().load(program)
+        rom = self.rom
+        # Superinstruction at each address (or None): (function, length)
+        self.superinstructions = [None] * self.ROM_SIZE
+        # Number of addresses where each template starts (also inside longer templates)
+        self.matches = {}
+        self.fused_cycles = 0
+        for address in range(self.program_size):
+            for name, words, builder in self._TEMPLATES:
+                end = address + len(words)
+                if end > self.program_size:
+                    continue
+                parameters = []
+                for expected, instruction in zip(words, rom[address:end]):
+                    if expected is None:
+                        if instruction & 0x8000:
+                            break
+                        parameters.append(instruction)
+                    elif instruction != expected:
+                        break
+                else:
+                    self.superinstructions[address] = (builder(*parameters, end & 0x7FFF), len(words))
+                    self.matches[name] = self.matches.get(name, 0) + 1
+                    break
+        # Number of instructions run one by one from each address: up to the
+        # next template, or through the next jump (which may land on one)
+        self._unfused_runs = [1] * self.ROM_SIZE
+        for address in range(self.program_size - 2, -1, -1):
+            instruction = rom[address]
+            if self.superinstructions[address + 1] is None and not (instruction & 0x8000 and instruction & 0x07):
+                self._unfused_runs[address] = self._unfused_runs[address + 1] + 1
+
+    def run(self, max_cycles):
+        """
+        Executes `max_cycles` instructions, running superinstructions where possible.
+
+        Returns: the number of cycles executed
+        """
+        superinstructions, unfused_runs, ram = self.superinstructions, self._unfused_runs, self.ram
+        a, d, pc = self.a, self.d, self.pc
+        remaining = max_cycles
+        fused_cycles = 0
+        while remaining > 0:
+            superinstruction = superinstructions[pc]
+            if superinstruction is not None and superinstruction[1] <= remaining:
+                a, d, pc = superinstruction[0](ram, a, d)
+                remaining -= superinstruction[1]
+                fused_cycles += superinstruction[1]
+            else:
+                # Not the start of a template (or not enough cycles left to run it)
+                cycles = min(unfused_runs[pc], remaining)
+                self.a, self.d, self.pc = a, d, pc
+                DecodedMachine.run(self, cycles)
+                a, d, pc = self.a, self.d, self.pc
+                remaining -= cycles
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += fused_cycles
+        self.fused_cycles += fused_cycles
+        return max_cycles
+
+    def report(self):
+        """Returns the report of the templates found in ROM, and of the cycles run fused."""
+        lines = [f"{'template':<20} {'matches':>8}"]
+        for name, count in sorted(self.matches.items(), key=lambda match: -match[1]):
+            lines.append(f"{name:<20} {count:>8}")
+        fused_words = set()
+        for address, superinstruction in enumerate(self.superinstructions):
+            if superinstruction is not None:
+                fused_words.update(range(address, address + superinstruction[1]))
+        lines.append(f"{len(fused_words)} of {self.program_size} ROM words in templates")
+        lines.append(f"{self.fused_cycles} of {self.cycles} cycles fused ({self.fused_cycles / (self.cycles or 1):.1%})")
+        return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs a VM-translated Hack program with superinstructions.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to run")
+    arg_parser.add_argument('--cycles', type=int, default=1000000, help="number of cycles to run (default: 1000000)")
+    args = arg_parser.parse_args()
+
+    fused = FusedMachine(args.filename)
+    seconds = timeit.timeit(lambda: fused.run(args.cycles), number=1)
+    decoded = DecodedMachine(args.filename)
+    baseline = timeit.timeit(lambda: decoded.run(args.cycles), number=1)
+    print(fused.report(), end='')
+    print(f"FusedMachine {seconds:.3f} s, DecodedMachine {baseline:.3f} s ({baseline / seconds:.2f}x)")
+    if (fused.a, fused.d, fused.pc, fused.ram) != (decoded.a, decoded.d, decoded.pc, decoded.ram):
+        print("Warning: the machines' states differ.")
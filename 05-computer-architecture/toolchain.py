@@ -0,0 +1,67 @@
+###############################################################################
+# 05-computer-architecture/toolchain.py
+# -------------------------------------
+# Gives the Python Hack machine's tools access to the rest of the toolchain,
+# so that they share its definitions instead of copying them:
+#   - the instruction encodings and predefined symbols of the assembler
+#     (06-assembler/code.py and symbol_table.py),
+#   - reading programs, as .hack files or .rom images (06-assembler/rom.py),
+#   - the symbol maps written by the assembler (06-assembler/symbol_map.py),
+#   - the function labels written by the VM translator, as the tree shaker
+#     finds them (06-assembler/tree_shaker.py),
+#   - assembling programs (with 06's InMemoryAssembler, in this process) and
+#     translating VM programs (with 08-vm-program-control/vm_translator.py).
+#
+# Importing this module makes the 06-assembler modules importable: their
+# directory is added to the module search path right after this one, so
+# that the modules of this directory (e.g. benchmark.py) still come first.
+# The VM translator runs in a process of its own, since its modules share
+# names with the assembler's (e.g. parser.py).
+#
+###############################################################################
+
+import os
+import shutil
+import subprocess
+import sys
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ASSEMBLER_DIRECTORY = os.path.normpath(os.path.join(_DIRECTORY, '..', '06-assembler'))
+
+if ASSEMBLER_DIRECTORY not in sys.path:
+    _position = next((index + 1 for index, entry in enumerate(sys.path)
+                      if os.path.abspath(entry or os.curdir) == _DIRECTORY), 0)
+    sys.path.insert(_position, ASSEMBLER_DIRECTORY)
+
+from assembler import InMemoryAssembler
+from code import Code
+from rom import Rom
+from symbol_map import SymbolMap
+from symbol_table import SymbolTable
+from tree_shaker import TreeShaker
+
+VM_TRANSLATOR = os.path.normpath(os.path.join(_DIRECTORY, '..', '08-vm-program-control', 'vm_translator.py'))
+
+
+def assemble(asm_filename):
+    """Assembles a .asm program (in memory). Returns: the instruction words (array)"""
+    with open(asm_filename) as asm_file:
+        return InMemoryAssembler(asm_file.readlines()).words
+
+
+def translate(vm_directory, directory, files=None):
+    """
+    Translates (with 08's VM translator) a copy of the .vm files of the
+    directory, with `files` (dict of .vm filename -> text) replacing or adding
+    files, into the temporary directory. Returns: the .asm filename
+    """
+    copy = os.path.join(directory, os.path.basename(vm_directory))
+    os.makedirs(copy)
+    for filename in os.listdir(vm_directory):
+        if filename.endswith('.vm'):
+            shutil.copyfile(os.path.join(vm_directory, filename), os.path.join(copy, filename))
+    for filename, text in (files or {}).items():
+        with open(os.path.join(copy, filename), 'w') as file:
+            file.write(text)
+    subprocess.run([sys.executable, VM_TRANSLATOR, copy], check=True)
+    return os.path.join(copy, os.path.basename(vm_directory) + '.asm')
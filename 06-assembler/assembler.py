@@ -10,15 +10,39 @@
 #   and translating the instructions as well as adding the variables it
 #   encounters into the symbol table.
 #
-# To run: python assembler.py <program>.asm
+# Alternatively, the InMemoryAssembler reads the program only once: forward
+# label references are left as holes in the instruction list and backpatched
+# once every label has been seen. It accepts any iterable of lines and can
+# stream the encoded words (or write them to any stream) without files.
+#
+# The assembled program is kept as a buffer of 16-bit words, written out as a
+# text .hack file or as a binary .rom image (see rom.py).
+#
+# Very large programs can also be split into chunks assembled in parallel by
+# a pool of worker processes (ParallelAssembler).
+#
+# Besides the book's comp mnemonics, the commutative spellings A+D, A&D, A|D,
+# M+D, M&D and M|D (written by the VM translator) are accepted (see code.py).
+#
+# With --map, the labels, variables and source line of each instruction are
+# also written to a <program>.map sidecar (see symbol_map.py).
+#
+# To run: python assembler.py [--single-pass] [--bulk] [--jobs N] [--rom] [--map] <program>.asm
 #
 ###############################################################################
 
+import argparse
+import multiprocessing
+import os
 import re
-import sys
+from array import array
 from os import path
+from parser import BulkParser
 from parser import Parser
 from code import Code
+from code import CInstructionCache
+from rom import Rom
+from symbol_map import SymbolMap
 from symbol_table import SymbolTable
 from symbol_table import SymbolTableBuilder
 
@@ -26,23 +50,70 @@ from symbol_table import SymbolTableBuilder
 class Assembler:
     _WORD_SIZE = 16 # Words are 16-bits long
 
-    def __init__(self, filename):
-        self._parser = Parser(filename)
-        self._symbol_table = SymbolTableBuilder(self._parser).build()
-        self._parser.reset()
+    # Instruction word of every C-instruction seen so far (shared by all programs)
+    c_instruction_cache = CInstructionCache()
+
+    def __init__(self, filename, single_pass=False, output_format='hack', bulk=False, workers=1, symbol_map=False):
+        """
+        Assembles the .asm file and writes the program next to it, either as
+        a text .hack file (output_format='hack') or as a binary ROM image
+        (output_format='rom'). Both are written from the same word buffer.
+
+        With bulk=True, the whole file is read and parsed up front by a
+        BulkParser instead of line by line.
+        With workers > 1, the file is split into chunks assembled in parallel
+        by a pool of processes (see ParallelAssembler).
+        With symbol_map=True, the program's SymbolMap is also written (.map).
+        """
+        if workers > 1:
+            self.words = ParallelAssembler(workers).assemble(filename)
+        elif single_pass:
+            if bulk:
+                source = BulkParser(filename)
+            else:
+                with open(filename) as asm_file:
+                    source = asm_file.readlines()
+            self.words = InMemoryAssembler(source).words
+        else:
+            self._parser = (Parser, BulkParser)[bulk](filename)
+            self._symbol_table = SymbolTableBuilder(self._parser).build()
+            self._parser.reset()
+            # Instruction words of the assembled program
+            self.words = array('H')
+            self._assemble()
+            self._parser.close()
+
+        self.save(filename, output_format, self._build_symbol_map(filename) if symbol_map else None)
 
-        self._assembler = open(self._get_filename(filename), 'w')
-        self._assemble()
+    def save(self, asm_filename, output_format='hack', symbol_map=None):
+        """
+        Writes the word buffer next to the .asm file, in the given format
+        ('hack' or 'rom'), and the symbol map (.map), if one is given.
+        """
+        if symbol_map is not None and len(symbol_map.lines) != len(self.words):
+            raise AssemblerError(f"Symbol map has {len(symbol_map.lines)} instructions, program has {len(self.words)}.")
+        if output_format == 'hack':
+            with open(self._get_filename(asm_filename), 'w') as hack_file:
+                Rom.write_text(self.words, hack_file)
+        elif output_format == 'rom':
+            with open(self._get_filename(asm_filename, ".rom"), 'wb') as rom_file:
+                Rom.write_binary(self.words, rom_file)
+        else:
+            raise AssemblerError(f"Unknown output format: {output_format}")
+        if symbol_map is not None:
+            with open(self._get_filename(asm_filename, ".map"), 'w') as map_file:
+                symbol_map.write(map_file)
 
-        self._parser.close()
-        self._assembler.close()
+    def _build_symbol_map(self, asm_filename):
+        """Builds the program's SymbolMap from its source."""
+        with open(asm_filename) as asm_file:
+            return SymbolMap.from_source(asm_file, path.basename(asm_filename))
 
-    def _get_filename(self, asm_filename):
-        """Converts .asm to .hack file extension."""
-        hack_extension = ".hack"
-        filename = re.compile(r'\.asm$', re.IGNORECASE).sub(hack_extension, asm_filename)
-        if not filename.endswith(hack_extension):
-            filename += hack_extension
+    def _get_filename(self, asm_filename, extension=".hack"):
+        """Converts .asm to .hack (or the given) file extension."""
+        filename = re.compile(r'\.asm$', re.IGNORECASE).sub(extension, asm_filename)
+        if not filename.endswith(extension):
+            filename += extension
         return filename
 
     def _assemble(self):
@@ -53,7 +124,7 @@ class Assembler:
             if command_type == 'L_COMMAND':
                 continue
             command = {'A_COMMAND': self._build_a_command, 'C_COMMAND': self._build_c_command,}[command_type]()
-            self._assembler.write(command + '\n')
+            self.words.append(command)
     
     def _build_a_command(self):
         """Parses 'A_COMMAND' types and returns corresponding constant or address of symbol."""
@@ -64,22 +135,11 @@ class Assembler:
             return self._get_a_address(symbol)
 
     def _get_a_constant(self, constant):
-        """Returns the constant value for 'A_COMMAND' symbol."""
-        max_size = self._WORD_SIZE - 1
-        binary = self._convert_decimal_to_binary(constant)
-        if len(binary) > max_size:
-            raise AssemblerError(f"Constant {constant} is too large. Only {max_size} bits available.")
-        # Pad with leading zeroes
-        return f"0{'0' * (max_size - len(binary))}{binary}"
-
-    def _convert_decimal_to_binary(self, num):
-        binary = ''
-        num = int(num)
-        while True:
-            binary = f"{num % 2}{binary}"
-            num /= 2
-            if num == 0:
-                return binary
+        """Returns the constant value for 'A_COMMAND' symbol (which is also its instruction word)."""
+        value = int(constant)
+        if value > Code.MAX_ADDRESS:
+            raise AssemblerError(f"Constant {constant} is too large. Only {self._WORD_SIZE - 1} bits available.")
+        return value
 
     def _get_a_address(self, symbol):
         """Returns the corresponding address for 'A_COMMAND' symbol."""
@@ -89,11 +149,253 @@ class Assembler:
         return self._get_a_constant(address)
 
     def _build_c_command(self):
-        """Returns corresponding binary code by looking up mnemonics for 'C_COMMAND'."""
-        comp_code = Code.comp(self._parser.comp())
-        dest_code = Code.dest(self._parser.dest())
-        jump_code = Code.jump(self._parser.jump())
-        return f"111{comp_code}{dest_code}{jump_code}"
+        """Returns corresponding instruction word by looking up mnemonics for 'C_COMMAND'."""
+        command = self._parser.command()
+        word = self.c_instruction_cache.get(command)
+        if word is None:
+            comp_code = Code.comp(self._parser.comp())
+            dest_code = Code.dest(self._parser.dest())
+            jump_code = Code.jump(self._parser.jump())
+            word = int(f"111{comp_code}{dest_code}{jump_code}", 2)
+            self.c_instruction_cache.add(command, word)
+        return word
+
+
+class InMemoryAssembler(Assembler):
+    """
+    Assembles a program held in memory in a single pass, without touching
+    disk. The program can be a string or any iterable of lines (e.g. a
+    generator producing assembly code on the fly).
+
+    Each instruction is encoded as soon as it is parsed. A-instructions whose
+    symbol is not known yet (forward label references and variables) are left
+    as holes, backpatched as soon as the label is defined; the symbols that
+    are still unknown at the end become variables, allocated in order of first
+    use exactly like the two-pass assembler does.
+    """
+
+    def __init__(self, source=None):
+        """Creates the assembler; if a source is given, it is assembled right away."""
+        self._reset()
+        if source is not None:
+            self.assemble(source)
+
+    def _reset(self):
+        """Starts a new program: each call to assemble() or stream() assembles from scratch."""
+        self._symbol_table = SymbolTable()
+        # Instruction words of the program (holes are 0 until backpatched)
+        self.words = array('H')
+        # Indices of the holes left by each unknown symbol (in order of first use)
+        self._unresolved = {}
+        self._holes = set()
+        # Number of words already handed out by stream()
+        self._emitted = 0
+
+    def assemble(self, source):
+        """
+        Assembles the whole program.
+
+        Arguments: source -- the assembly program (string, iterable of lines or Parser)
+        Returns: the instruction words of the program (array)
+        """
+        self._reset()
+        for _ in self._encode(source):
+            pass
+        self._add_variables()
+        self._emitted = len(self.words)
+        return self.words
+
+    def stream(self, source):
+        """
+        Assembles the program while reading it, yielding each instruction word
+        as soon as it and every word before it are final (i.e. up to the first
+        hole still waiting for a label).
+
+        Arguments: source -- the assembly program (string, iterable of lines or Parser)
+        """
+        self._reset()
+        for _ in self._encode(source):
+            yield from self._final_words()
+        self._add_variables()
+        yield from self._final_words()
+
+    def _encode(self, source):
+        """Encodes the program one instruction at a time, yielding after each one."""
+        if isinstance(source, Parser):
+            self._parser = source
+        else:
+            if isinstance(source, str):
+                source = source.splitlines()
+            self._parser = Parser(source)
+        while self._parser.has_more_commands():
+            self._parser.advance()
+            command_type = self._parser.command_type()
+            if command_type == 'L_COMMAND':
+                self._add_label(self._parser.symbol())
+                continue
+            command = {'A_COMMAND': self._build_a_command, 'C_COMMAND': self._build_c_command,}[command_type]()
+            self.words.append(command)
+            yield
+
+    def write(self, source, stream, output_format='hack'):
+        """
+        Assembles the program and writes it to any writable stream as it goes.
+
+        Arguments:
+        source -- the assembly program (string or iterable of lines)
+        stream -- a text stream for 'hack' output, a binary stream for 'rom' output
+        output_format -- 'hack' or 'rom'
+        """
+        if output_format == 'hack':
+            Rom.write_text(self.stream(source), stream)
+        elif output_format == 'rom':
+            Rom.write_binary(self.stream(source), stream)
+        else:
+            raise AssemblerError(f"Unknown output format: {output_format}")
+
+    def _final_words(self):
+        """Returns the words that are final but were not handed out yet."""
+        start = self._emitted
+        end = len(self.words)
+        while self._emitted < end and self._emitted not in self._holes:
+            self._emitted += 1
+        return self.words[start:self._emitted]
+
+    def _get_a_address(self, symbol):
+        """Returns the address for a known symbol; otherwise leaves a hole to backpatch."""
+        if not self._symbol_table.contains(symbol):
+            index = len(self.words)
+            self._unresolved.setdefault(symbol, []).append(index)
+            self._holes.add(index)
+            return 0
+        return self._get_a_constant(self._symbol_table.get_address(symbol))
+
+    def _add_label(self, symbol):
+        """Adds the label at the current ROM address and fills in the holes waiting for it."""
+        self._symbol_table.add_entry(symbol, len(self.words))
+        self._backpatch(symbol, self._unresolved.pop(symbol, ()))
+
+    def _add_variables(self):
+        """Allocates the symbols still unknown at the end of the program as variables."""
+        for symbol, indices in self._unresolved.items():
+            self._symbol_table.add_variable(symbol)
+            self._backpatch(symbol, indices)
+        self._unresolved = {}
+
+    def _backpatch(self, symbol, indices):
+        """Fills in the holes left by the symbol with its address."""
+        address = self._get_a_constant(self._symbol_table.get_address(symbol))
+        for index in indices:
+            self.words[index] = address
+            self._holes.discard(index)
+
+
+class ChunkAssembler(InMemoryAssembler):
+    """
+    Assembles one chunk of a larger program, on its own.
+
+    Labels are recorded at their address within the chunk but not resolved,
+    so every A-instruction with a symbol other than the predefined ones is
+    left as a hole: the chunk's position in the program (and so its labels'
+    ROM addresses) and the variables are only known once all chunks are merged.
+    """
+
+    def __init__(self, lines):
+        super().__init__()
+        # Address (within chunk) of each label
+        self.labels = {}
+        for _ in self._encode(lines):
+            pass
+        # Indices of the holes left by each symbol (in order of first use)
+        self.unresolved = self._unresolved
+
+    def _add_label(self, symbol):
+        self.labels[symbol] = len(self.words)
+
+
+def _assemble_chunk(filename, start, end):
+    """
+    Assembles the bytes [start, end) of the file (whole lines) in a worker process.
+
+    Returns: (words, labels, unresolved) -- the chunk's instruction words, its
+    labels (symbol: address within chunk), and the holes left by each symbol
+    (symbol: indices within chunk, in order of first use)
+    """
+    with open(filename, 'rb') as asm_file:
+        asm_file.seek(start)
+        lines = asm_file.read(end - start).decode().splitlines()
+    chunk = ChunkAssembler(lines)
+    return chunk.words, chunk.labels, chunk.unresolved
+
+
+class ParallelAssembler:
+    """
+    Assembles a large program by splitting it into chunks of whole lines,
+    assembled in parallel by a pool of worker processes.
+
+    Each worker encodes its chunk, collecting the chunk's labels and the
+    symbolic A-instructions it could not resolve. The chunks are then merged
+    in program order: labels get their ROM address (chunk offset + address
+    within chunk), then the remaining symbols are allocated as variables in
+    order of first use and the holes are backpatched. The result is identical
+    to the serial assembler's.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Arguments: workers -- number of worker processes (default: number of CPUs)
+        """
+        self._workers = workers or os.cpu_count()
+
+    def assemble(self, filename):
+        """
+        Assembles the .asm file.
+
+        Returns: the instruction words of the program (array)
+        """
+        chunks = self._split(filename)
+        with multiprocessing.Pool(min(self._workers, len(chunks))) as pool:
+            results = pool.starmap(_assemble_chunk, chunks)
+        return self._merge(results)
+
+    def _split(self, filename):
+        """Splits the file into (filename, start, end) byte ranges ending on line boundaries."""
+        size = os.path.getsize(filename)
+        chunks = []
+        with open(filename, 'rb') as asm_file:
+            start = 0
+            for i in range(1, self._workers + 1):
+                asm_file.seek(max(start, size * i // self._workers))
+                asm_file.readline()
+                end = min(asm_file.tell(), size)
+                if end > start:
+                    chunks.append((filename, start, end))
+                start = end
+        return chunks or [(filename, 0, 0)]
+
+    def _merge(self, results):
+        """Resolves labels and variables across chunks and joins their words."""
+        symbol_table = SymbolTable()
+        offsets = []
+        offset = 0
+        for chunk_words, labels, _ in results:
+            for symbol, address in labels.items():
+                symbol_table.add_entry(symbol, offset + address)
+            offsets.append(offset)
+            offset += len(chunk_words)
+
+        words = array('H')
+        for (chunk_words, _, unresolved), offset in zip(results, offsets):
+            for symbol, indices in unresolved.items():
+                if not symbol_table.contains(symbol):
+                    symbol_table.add_variable(symbol)
+                address = symbol_table.get_address(symbol)
+                if address > Code.MAX_ADDRESS:
+                    raise AssemblerError(f"Address {address} of {symbol} is too large.")
+                for index in indices:
+                    chunk_words[index] = address
+            words.extend(chunk_words)
+        return words
 
 
 # For assembler error exception; does nothing (just for convention)
@@ -102,4 +404,22 @@ class AssemblerError(Exception):
 
 
 if __name__ == "__main__":
-    Assembler(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(description="Translates Hack assembly into Hack binary code.")
+    arg_parser.add_argument('filename', help="the .asm program to assemble")
+    arg_parser.add_argument('--single-pass', action='store_true',
+                            help="read the program once and backpatch forward label references")
+    arg_parser.add_argument('--bulk', action='store_true',
+                            help="read and parse the whole file up front")
+    arg_parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                            help="assemble chunks of the file in N worker processes")
+    arg_parser.add_argument('--rom', action='store_true',
+                            help="write a binary ROM image (.rom) instead of a .hack file")
+    arg_parser.add_argument('--map', action='store_true',
+                            help="also write the symbol and source map (.map)")
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help="report C-instruction cache hits and misses")
+    args = arg_parser.parse_args()
+    Assembler(args.filename, single_pass=args.single_pass, output_format=('hack', 'rom')[args.rom],
+              bulk=args.bulk, workers=args.jobs, symbol_map=args.map)
+    if args.cache_stats:
+        print(Assembler.c_instruction_cache)
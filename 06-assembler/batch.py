@@ -0,0 +1,122 @@
+###############################################################################
+# 06-assembler/batch.py
+# ---------------------
+# The BatchAssembler assembles many programs in one run: .asm files and
+# directories (searched recursively for .asm files, except the .opt.asm and
+# .dis.asm files written by the optimizer and disassembler) are handed out to
+# a pool of worker processes, so that the interpreter start-up and imports
+# are paid once per worker instead of once per program.
+#
+# Each program is assembled as `assembler.py` would (its output is written
+# next to it); a failing program does not stop the others. The time taken
+# and the error (if any) of every program are reported at the end.
+#
+# To run: python batch.py [--jobs N] [--rom] [--map] <program>.asm|<directory> ...
+#
+###############################################################################
+
+import argparse
+import multiprocessing
+import os
+import time
+from assembler import Assembler
+
+
+def _assemble_file(filename, options):
+    """
+    Assembles one program in a worker process.
+
+    Returns: (filename, seconds, words, error) -- the number of words of the
+    program, or the error message if it could not be assembled
+    """
+    start = time.perf_counter()
+    try:
+        words = len(Assembler(filename, **options).words)
+        error = None
+    except Exception as exception:
+        words = 0
+        error = f"{type(exception).__name__}: {exception}"
+    return filename, time.perf_counter() - start, words, error
+
+
+class BatchAssembler:
+    # Assembly written by the other tools (optimizer.py, disassembler.py),
+    # skipped when searching directories
+    _GENERATED_SUFFIXES = ('.opt.asm', '.dis.asm')
+
+    def __init__(self, workers=None, **options):
+        """
+        Arguments:
+        workers -- number of worker processes (default: number of CPUs)
+        options -- keyword arguments passed to the Assembler of each program
+                   (output_format, single_pass, bulk, symbol_map)
+        """
+        self._workers = workers or os.cpu_count()
+        self._options = options
+
+    def assemble(self, paths):
+        """
+        Assembles every program found in the paths (.asm files or directories).
+
+        Returns: a list of (filename, seconds, words, error) results, in the
+        order the programs were found
+        """
+        filenames = self.find_programs(paths)
+        if not filenames:
+            return []
+        if self._workers == 1:
+            results = [_assemble_file(filename, self._options) for filename in filenames]
+        else:
+            with multiprocessing.Pool(min(self._workers, len(filenames))) as pool:
+                results = pool.starmap(_assemble_file, ((filename, self._options) for filename in filenames),
+                                       chunksize=1)
+        return results
+
+    @classmethod
+    def find_programs(cls, paths):
+        """
+        Returns the .asm files among the paths and in the directories
+        (recursively, excluding the output of the other tools), sorted.
+        """
+        filenames = []
+        for path in paths:
+            if os.path.isdir(path):
+                for directory, _, names in os.walk(path):
+                    filenames.extend(os.path.join(directory, name) for name in sorted(names)
+                                     if name.lower().endswith('.asm')
+                                     and not name.lower().endswith(cls._GENERATED_SUFFIXES))
+            else:
+                filenames.append(path)
+        return sorted(filenames)
+
+    @staticmethod
+    def report(results, seconds=None):
+        """Returns the report of a batch: one line per program, then the totals."""
+        lines = []
+        for filename, elapsed, words, error in results:
+            lines.append(f"{filename:<60} {words:>7} words {elapsed * 1000:9.1f} ms"
+                         f"{f'  FAILED: {error}' if error else ''}")
+        failed = sum(error is not None for _, _, _, error in results)
+        total = sum(words for _, _, words, _ in results)
+        lines.append(f"{len(results)} programs, {failed} failed, {total} words"
+                     f"{f' in {seconds:.3f} s ({len(results) / seconds:.1f} programs/s)' if seconds else ''}")
+        return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Assembles many Hack programs with a pool of workers.")
+    arg_parser.add_argument('paths', nargs='+', help=".asm programs or directories containing them")
+    arg_parser.add_argument('--jobs', type=int, default=None, metavar='N',
+                            help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument('--rom', action='store_true',
+                            help="write binary ROM images (.rom) instead of .hack files")
+    arg_parser.add_argument('--map', action='store_true',
+                            help="also write the symbol and source maps (.map)")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    results = BatchAssembler(args.jobs, output_format=('hack', 'rom')[args.rom],
+                             symbol_map=args.map).assemble(args.paths)
+    print(BatchAssembler.report(results, time.perf_counter() - start), end='')
+    if any(error for _, _, _, error in results):
+        raise SystemExit(1)
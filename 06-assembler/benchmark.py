@@ -0,0 +1,196 @@
+###############################################################################
+# 06-assembler/benchmark.py
+# -------------------------
+# Micro-benchmarks for the Hack assembler.
+# Each benchmark times one stage of the assembler in isolation and reports
+# the cost per instruction (or per line) processed.
+#
+# To run: python benchmark.py
+#
+###############################################################################
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from assembler import Assembler
+from assembler import InMemoryAssembler
+from batch import BatchAssembler
+from code import CInstructionCache
+from code import Code
+from incremental import IncrementalAssembler
+from parser import BulkParser
+from parser import Parser
+
+# Sample program (generated by the VM translator) used to build large inputs
+_SAMPLE_PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pong', 'Pong.asm')
+
+# Root of the repository, whose .asm programs make up the batch corpus
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _report(name, count, seconds):
+    """Prints the total and per-instruction time for a benchmark run."""
+    print(f"{name:<32} {count:>9} instr  {seconds:8.3f} s  {seconds / count * 1e9:8.1f} ns/instr")
+
+
+def _encode_a_instruction_by_digits(value):
+    """Reference encoder: builds the binary string one digit at a time."""
+    binary = ''
+    while True:
+        binary = f"{value % 2}{binary}"
+        value //= 2
+        if value == 0:
+            break
+    return f"{'0' * (16 - len(binary))}{binary}"
+
+
+def bench_a_instructions(count=100000):
+    """Times encoding `count` A-instructions spread over the 15-bit range."""
+    values = [(i * 7919) & Code.MAX_ADDRESS for i in range(count)]
+    # Build the lookup table outside of the timed region
+    Code.address(0)
+
+    seconds = timeit.timeit(lambda: [_encode_a_instruction_by_digits(v) for v in values], number=1)
+    _report("A-instruction (digit loop)", count, seconds)
+    seconds = timeit.timeit(lambda: [f'{v:016b}' for v in values], number=1)
+    _report("A-instruction (format)", count, seconds)
+    seconds = timeit.timeit(lambda: [Code.address(v) for v in values], number=1)
+    _report("A-instruction (Code.address)", count, seconds)
+
+
+def bench_c_instructions(count=100000):
+    """Times assembling `count` C-instructions typical of VM translator output."""
+    instructions = ['M=M+1', 'A=M-1', 'M=D', 'AM=M-1', 'D=M', 'D=A', 'A=M', '0;JMP', 'D;JNE', 'D=A-D']
+    lines = [instructions[i % len(instructions)] for i in range(count)]
+
+    # Start every run from an empty cache so the misses are included
+    def assemble():
+        InMemoryAssembler.c_instruction_cache = CInstructionCache()
+        InMemoryAssembler(lines)
+
+    seconds = timeit.timeit(assemble, number=1)
+    _report("C-instruction (cached)", count, seconds)
+    print(f"  {InMemoryAssembler.c_instruction_cache}")
+
+
+def _write_large_program(filename, line_count, labels=True):
+    """
+    Writes a program of (at least) `line_count` lines by repeating the sample program.
+
+    Without labels, the label symbols become variables so that the program
+    can actually be assembled (its labels would not fit in 15 bits).
+    """
+    with open(_SAMPLE_PROGRAM) as asm_file:
+        sample = asm_file.readlines()
+    if not labels:
+        sample = [line for line in sample if not line.lstrip().startswith('(')]
+    with open(filename, 'w') as asm_file:
+        for _ in range(-(-line_count // len(sample))):
+            asm_file.writelines(sample)
+    return -(-line_count // len(sample)) * len(sample)
+
+
+def _parse_all(parser):
+    """Runs through every command of the parser twice, as the two assembler passes do."""
+    for _ in range(2):
+        parser.reset()
+        while parser.has_more_commands():
+            parser.advance()
+            if parser.command_type() != 'C_COMMAND':
+                parser.symbol()
+    parser.close()
+
+
+def bench_parsers(line_count=1000000):
+    """Compares lines/second of the readline Parser and the BulkParser (over both passes)."""
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'Large.asm')
+        line_count = _write_large_program(filename, line_count)
+        for name, parser_class in (("Parser (readline)", Parser), ("BulkParser (findall)", BulkParser)):
+            seconds = timeit.timeit(lambda: _parse_all(parser_class(filename)), number=1)
+            print(f"{name:<32} {line_count:>9} lines  {seconds:8.3f} s  {line_count / seconds:10.0f} lines/s")
+
+
+def bench_parallel(line_count=1000000, workers=4):
+    """Compares the serial and parallel assemblers on a multi-megabyte program."""
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'Large.asm')
+        line_count = _write_large_program(filename, line_count, labels=False)
+        megabytes = os.path.getsize(filename) / 2**20
+        serial = timeit.timeit(lambda: Assembler(filename, bulk=True), number=1)
+        with open(os.path.join(directory, 'Large.hack'), 'rb') as hack_file:
+            expected = hack_file.read()
+        parallel = timeit.timeit(lambda: Assembler(filename, workers=workers), number=1)
+        with open(os.path.join(directory, 'Large.hack'), 'rb') as hack_file:
+            identical = hack_file.read() == expected
+    print(f"{'Assembler (serial, bulk)':<32} {megabytes:6.1f} MB  {serial:8.3f} s")
+    print(f"{f'ParallelAssembler ({workers} workers)':<32} {megabytes:6.1f} MB  {parallel:8.3f} s"
+          f"  {serial / parallel:5.2f}x  ({os.cpu_count()} CPUs, output identical: {identical})")
+
+
+def bench_incremental():
+    """Compares a full re-assembly with an incremental one after a small edit."""
+    with open(_SAMPLE_PROGRAM) as asm_file:
+        lines = asm_file.readlines()
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'Edited.asm')
+        with open(filename, 'w') as asm_file:
+            asm_file.writelines(lines)
+        IncrementalAssembler(filename)
+
+        # Edit a few instructions in the middle of the program
+        middle = len(lines) // 2
+        lines[middle:middle] = ['@edited\n', 'M=D\n', '@SP\n', 'M=M+1\n']
+        with open(filename, 'w') as asm_file:
+            asm_file.writelines(lines)
+        full = timeit.timeit(lambda: Assembler(filename, bulk=True), number=1)
+        assembler = None
+        def rebuild():
+            nonlocal assembler
+            assembler = IncrementalAssembler(filename)
+        incremental = timeit.timeit(rebuild, number=1)
+    print(f"{'Assembler (full rebuild)':<32} {full:8.3f} s")
+    print(f"{'IncrementalAssembler':<32} {incremental:8.3f} s  {full / incremental:5.2f}x"
+          f"  ({assembler.encoded} encoded, {assembler.patched} patched)")
+
+
+def bench_batch(workers=None):
+    """
+    Compares assembling every .asm program of the repository with one
+    `assembler.py` process per program and with one BatchAssembler run.
+    """
+    assembler_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assembler.py')
+    with tempfile.TemporaryDirectory() as directory:
+        # Work on a copy, so that the outputs are not written into the repository
+        for filename in BatchAssembler.find_programs([_REPOSITORY]):
+            copy = os.path.join(directory, os.path.relpath(filename, _REPOSITORY))
+            os.makedirs(os.path.dirname(copy), exist_ok=True)
+            shutil.copyfile(filename, copy)
+        filenames = BatchAssembler.find_programs([directory])
+
+        processes = timeit.timeit(lambda: [subprocess.run([sys.executable, assembler_script, filename],
+                                                          stderr=subprocess.DEVNULL)
+                                           for filename in filenames], number=1)
+        results = None
+        def batch():
+            nonlocal results
+            results = BatchAssembler(workers).assemble([directory])
+        seconds = timeit.timeit(batch, number=1)
+    failed = sum(error is not None for _, _, _, error in results)
+    print(f"{'assembler.py (process/program)':<32} {len(filenames):>5} programs  {processes:8.3f} s"
+          f"  {len(filenames) / processes:7.1f} programs/s")
+    print(f"{'BatchAssembler':<32} {len(filenames):>5} programs  {seconds:8.3f} s"
+          f"  {len(filenames) / seconds:7.1f} programs/s  {processes / seconds:5.2f}x"
+          f"  ({os.cpu_count()} CPUs, {failed} failed)")
+
+
+if __name__ == "__main__":
+    bench_a_instructions()
+    bench_c_instructions()
+    bench_parsers()
+    bench_parallel()
+    bench_incremental()
+    bench_batch()
@@ -52,6 +52,15 @@ class Translate:
             'M-D': '1000111',
             'D&M': '1000000',
             'D|M': '1010101',
+            # Commutative spellings, not in the book's specification: an
+            # extension of the assembly language, accepted because the VM
+            # translator (08) writes them, e.g. `D=A+D` and `D=M+D`
+            'A+D': '0000010',
+            'A&D': '0000000',
+            'A|D': '0010101',
+            'M+D': '1000010',
+            'M&D': '1000000',
+            'M|D': '1010101',
         },
 
         'jump': {
@@ -72,6 +81,34 @@ class Code:
     Return the binary code of the specified field type (mnemonic).
     """
 
+    # Instructions are 16-bit words
+    WORD_SIZE = 16
+
+    # Largest constant/address that fits in the 15-bit A-instruction field
+    MAX_ADDRESS = 0x7FFF
+
+    # Binary codes of every A-instruction, indexed by its 15-bit value
+    # (built on first use)
+    _a_instructions = None
+
+    @staticmethod
+    def address(value):
+        """
+        Return the binary code of the A-instruction `@value`.
+
+        The value must be an integer in the range [0, MAX_ADDRESS].
+        """
+        if Code._a_instructions is None:
+            Code._a_instructions = [f'{i:016b}' for i in range(Code.MAX_ADDRESS + 1)]
+        return Code._a_instructions[value]
+
+    @staticmethod
+    def binary(word):
+        """Return the binary code (16-character string) of an instruction word."""
+        if word <= Code.MAX_ADDRESS:
+            return Code.address(word)
+        return f'{word:016b}'
+
     @staticmethod
     def dest(mnemonic):
         return Translate.CODES['dest'][mnemonic]
@@ -84,3 +121,39 @@ class Code:
     def jump(mnemonic):
         return Translate.CODES['jump'][mnemonic]
 
+
+class CInstructionCache:
+    """
+    Cache the instruction word of whole C-instructions, keyed by the instruction
+    text (as returned by the Parser, with whitespace and comments removed).
+
+    Generated programs repeat the same few dozen C-instructions over and
+    over, so each one is decoded and encoded only the first time it is seen.
+    The hit/miss counters are kept for profiling.
+    """
+
+    def __init__(self):
+        self._words = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, instruction):
+        """Return the cached word of the instruction, or None if not cached yet."""
+        word = self._words.get(instruction)
+        if word is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return word
+
+    def add(self, instruction, word):
+        """Store the word of the instruction."""
+        self._words[instruction] = word
+
+    def __len__(self):
+        return len(self._words)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"{len(self)} C-instructions cached, {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate)"
@@ -0,0 +1,216 @@
+###############################################################################
+# 06-assembler/disassembler.py
+# ----------------------------
+# The Disassembler translates Hack machine code (.hack programs or binary .rom
+# images) back into Hack assembly language.
+#
+# Every 16-bit word is decoded with a single lookup in a 65536-entry table,
+# built by inverting the mnemonic tables of the Code module (Translate.CODES).
+# The table is built once and cached on disk, so later runs only read it;
+# a cached table is checked (size and sample entries) before it is used.
+#
+# Words with no assembly form (C-instructions whose bits 13-14 are not set,
+# or with an ALU operation that has no mnemonic) are listed as comments, so
+# the listing still has one line per ROM address.
+#
+# An optional symbol map restores the names lost by the assembler: labels
+# are declared again at their addresses (up to the end of the program) and
+# used as jump targets, and variables replace every A-instruction loading
+# their address. Variables are only renamed as long as assembling the
+# listing again allocates them the same addresses (in order of first use).
+#
+# To run: python disassembler.py [--symbols <program>.map] <program>.hack|.rom
+# (writes the assembly program to <program>.dis.asm; the symbol map is the
+# one written by `assembler.py --map`)
+#
+###############################################################################
+
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+from code import Code
+from code import Translate
+from rom import Rom
+from symbol_map import SymbolMap
+from symbol_table import SymbolTable
+
+
+class Disassembler:
+    _TABLE_SIZE = 1 << Code.WORD_SIZE
+
+    # Version of the decode table's format (the commands written by
+    # _build_table()): to be increased whenever it changes
+    _TABLE_VERSION = 1
+
+    # Decode table cached on disk, named after a digest of the table format
+    # and of the mnemonic tables (so that it is rebuilt whenever they change)
+    _TABLE_DIGEST = hashlib.sha1(f"{_TABLE_VERSION}:{Translate.CODES!r}".encode()).hexdigest()[:12]
+    _TABLE_FILENAME = os.path.join(tempfile.gettempdir(), f"hack-decode-{_TABLE_DIGEST}.table")
+
+    # Assembly of every instruction word, indexed by the word (loaded on first use)
+    _table = None
+
+    def __init__(self, labels=None, variables=None):
+        """
+        Arguments:
+        labels -- optional dict mapping label names to their ROM address
+        variables -- optional dict mapping variable names to their RAM address
+        """
+        # Names by address (the first name wins when several share an address)
+        self._labels = self._by_address(labels or {})
+        self._variables = self._by_address(variables or {})
+
+    @classmethod
+    def table(cls):
+        """Returns the decode table: the assembly of every 16-bit word (list of 65536 strings)."""
+        if cls._table is None:
+            cls._table = cls._load_table()
+        return cls._table
+
+    def disassemble(self, words):
+        """
+        Disassembles the instruction words (any sequence of ints).
+
+        Returns: the assembly program, as a list of commands (one per word,
+        plus the label declarations when labels are known)
+        """
+        commands = list(map(self.table().__getitem__, words))
+        if self._labels or self._variables:
+            commands = self._annotate(words, commands)
+        return commands
+
+    def write(self, words, stream):
+        """Writes the disassembled words (one command per line) to a (text) stream."""
+        commands = self.disassemble(words)
+        stream.write('\n'.join(commands))
+        if commands:
+            stream.write('\n')
+
+    def disassemble_file(self, filename):
+        """Disassembles a .hack program or a binary ROM image (by extension)."""
+        return self.disassemble(Rom.load(filename))
+
+    @classmethod
+    def _load_table(cls):
+        """Reads the cached decode table, or builds it (and caches it) if there is none."""
+        try:
+            with open(cls._TABLE_FILENAME) as table_file:
+                table = table_file.read().split('\n')
+            if cls._check_table(table):
+                return table
+        except OSError:
+            pass
+
+        table = cls._build_table()
+        # Write to a temporary file first, so that a concurrent reader never sees half a table
+        try:
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(cls._TABLE_FILENAME))
+            with os.fdopen(fd, 'w') as table_file:
+                table_file.write('\n'.join(table))
+            os.replace(temporary, cls._TABLE_FILENAME)
+        except OSError:
+            # Not cached: it is just built again next time
+            pass
+        return table
+
+    @classmethod
+    def _check_table(cls, table):
+        """Checks that a cached decode table is whole and decodes sample words as _build_table() does."""
+        samples = {
+            0: '@0',
+            Code.MAX_ADDRESS: f'@{Code.MAX_ADDRESS}',
+            int(f"111{Code.comp('0')}{Code.dest(None)}{Code.jump('JMP')}", 2): '0;JMP',
+            int(f"111{Code.comp('M-1')}{Code.dest('AM')}{Code.jump(None)}", 2): 'AM=M-1',
+            int(f"111{Code.comp('D')}{Code.dest(None)}{Code.jump('JGT')}", 2): 'D;JGT',
+        }
+        return len(table) == cls._TABLE_SIZE and all(table[word] == command for word, command in samples.items())
+
+    @classmethod
+    def _build_table(cls):
+        """Builds the decode table by inverting the mnemonic tables."""
+        # Binary code -> mnemonic (the first, canonical spelling wins over its aliases)
+        mnemonics = {}
+        for field, codes in Translate.CODES.items():
+            mnemonics[field] = {}
+            for mnemonic, code in codes.items():
+                mnemonics[field].setdefault(int(code, 2), mnemonic)
+
+        table = [f'@{word}' for word in range(Code.MAX_ADDRESS + 1)]
+        for word in range(Code.MAX_ADDRESS + 1, cls._TABLE_SIZE):
+            comp = mnemonics['comp'].get((word >> 6) & 0x7F)
+            if word & 0x6000 != 0x6000 or comp is None:
+                table.append(f'// invalid instruction {word:016b}')
+                continue
+            dest = mnemonics['dest'][(word >> 3) & 0x7]
+            jump = mnemonics['jump'][word & 0x7]
+            table.append(f"{f'{dest}=' if dest else ''}{comp}{f';{jump}' if jump else ''}")
+        return table
+
+    def _by_address(self, symbols):
+        names = {}
+        for name, address in symbols.items():
+            names.setdefault(address, name)
+        return names
+
+    def _annotate(self, words, commands):
+        """Declares the labels and replaces the addresses of jump targets and variables by names."""
+        # Name replacing the address loaded by each A-instruction (or None)
+        names = [None] * len(words)
+        for address in range(len(words) - 1):
+            word, next_word = words[address], words[address + 1]
+            if word <= Code.MAX_ADDRESS and next_word > Code.MAX_ADDRESS and next_word & 0x7 and word in self._labels:
+                names[address] = self._labels[word]
+        variables = self._renamed_variables(words, names)
+        for address, word in enumerate(words):
+            if names[address] is None and word in variables:
+                names[address] = variables[word]
+
+        annotated = []
+        for address, command in enumerate(commands):
+            if address in self._labels:
+                annotated.append(f'({self._labels[address]})')
+            annotated.append(command if names[address] is None else f'@{names[address]}')
+        # Label at the end of the program (e.g. a jump past the last instruction)
+        if len(words) in self._labels:
+            annotated.append(f'({self._labels[len(words)]})')
+        return annotated
+
+    def _renamed_variables(self, words, names):
+        """
+        Returns the variables (by address) whose uses can all be renamed.
+
+        The assembler allocates variables in order of first use, so going
+        through them in order of first use in the listing, a variable is
+        renamed only if it would get its own address back when the listing is
+        assembled again; the others keep their raw addresses (which do not
+        allocate anything).
+        """
+        first_uses = {}
+        for address, word in enumerate(words):
+            if word <= Code.MAX_ADDRESS and names[address] is None and word in self._variables:
+                first_uses.setdefault(word, address)
+        symbol_table = SymbolTable()
+        variables = {}
+        for word in sorted(first_uses, key=first_uses.get):
+            if symbol_table.next_variable_address() == word:
+                symbol_table.add_variable(self._variables[word])
+                variables[word] = self._variables[word]
+        return variables
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Translates a Hack program back into assembly.")
+    arg_parser.add_argument('filename', help="the .hack program or .rom image to disassemble")
+    arg_parser.add_argument('--symbols', help="symbol map restoring label and variable names")
+    args = arg_parser.parse_args()
+
+    if args.symbols:
+        symbol_map = SymbolMap.load(args.symbols)
+        disassembler = Disassembler(symbol_map.labels, symbol_map.variables)
+    else:
+        disassembler = Disassembler()
+    output_filename = re.compile(r'(\.hack|\.rom)?$', re.IGNORECASE).sub('.dis.asm', args.filename, count=1)
+    with open(output_filename, 'w') as asm_file:
+        disassembler.write(Rom.load(args.filename), asm_file)
@@ -0,0 +1,248 @@
+###############################################################################
+# 06-assembler/incremental.py
+# ---------------------------
+# The IncrementalAssembler re-assembles a program after an edit by reusing the
+# previous run's results, stored in a cache file next to the output:
+# the source lines, the instruction words, the symbol of each symbolic
+# A-instruction, and the addresses of all labels and variables.
+#
+# The new source is compared with the cached one: the common leading and
+# trailing lines are kept as is, and only the changed region in between is
+# parsed and encoded again. Labels after the region are shifted, variables
+# are re-allocated, and only the A-instructions whose symbol's address moved
+# are patched.
+#
+# To run: python incremental.py [--rom] <program>.asm
+#
+###############################################################################
+
+import argparse
+import pickle
+import re
+from array import array
+from assembler import AssemblerError
+from assembler import ChunkAssembler
+from code import Code
+from parser import parse_symbol
+from parser import strip_command
+from rom import Rom
+from symbol_table import SymbolTable
+
+
+class IncrementalAssembler:
+    _CACHE_VERSION = 1
+    _CACHE_EXTENSION = ".cache"
+
+    def __init__(self, filename, output_format='hack'):
+        """
+        Assembles the .asm file, reusing the cache of the previous run (if any),
+        then writes the program and the updated cache.
+
+        Arguments:
+        filename -- the .asm program to assemble (string)
+        output_format -- 'hack' (text) or 'rom' (binary ROM image)
+        """
+        self._output_filename = self._get_filename(filename, ('.hack', '.rom')[output_format == 'rom'])
+        self._cache_filename = self._output_filename + self._CACHE_EXTENSION
+
+        cache = self._load_cache()
+        self._assemble(self._read_lines(filename), cache)
+
+        if output_format == 'rom':
+            with open(self._output_filename, 'wb') as rom_file:
+                Rom.write_binary(self.words, rom_file)
+        else:
+            self._write_text(len(cache['words']))
+        self._save_cache()
+
+    def _get_filename(self, asm_filename, extension):
+        """Converts .asm to the given file extension."""
+        filename = re.compile(r'\.asm$', re.IGNORECASE).sub(extension, asm_filename)
+        if not filename.endswith(extension):
+            filename += extension
+        return filename
+
+    def _read_lines(self, filename):
+        """Reads the program's lines (without line terminators)."""
+        with open(filename) as asm_file:
+            return asm_file.read().splitlines()
+
+    def _load_cache(self):
+        """Returns the state cached by the previous run, or an empty state."""
+        try:
+            with open(self._cache_filename, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+            if cache['version'] == self._CACHE_VERSION:
+                return cache
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            pass
+        return {'version': self._CACHE_VERSION, 'lines': [], 'instruction_lines': b'',
+                'labels': [], 'words': array('H'), 'symbols': [], 'addresses': {}}
+
+    def _save_cache(self):
+        with open(self._cache_filename, 'wb') as cache_file:
+            pickle.dump(self._cache, cache_file, pickle.HIGHEST_PROTOCOL)
+
+    def _assemble(self, lines, cache):
+        """Re-encodes the changed region of the program and patches moved addresses."""
+        old_lines = cache['lines']
+        start, old_end, new_end = self._find_changed_region(old_lines, lines)
+
+        # Instruction indices where the changed region starts/ends in the old program
+        # (instruction_lines has a 1 for each line holding an instruction)
+        first = cache['instruction_lines'][:start].count(1)
+        old_last = first + cache['instruction_lines'][start:old_end].count(1)
+
+        region = ChunkAssembler(lines[start:new_end])
+        region_symbols = [None] * len(region.words)
+        for symbol, indices in region.unresolved.items():
+            for index in indices:
+                region_symbols[index] = symbol
+        region_end = first + len(region.words)
+        shift = region_end - old_last
+
+        self.words = cache['words'][:first] + region.words + cache['words'][old_last:]
+        # Symbol of each instruction (None unless it is a symbolic A-instruction)
+        symbols = cache['symbols'][:first] + region_symbols + cache['symbols'][old_last:]
+        instruction_lines, region_labels = self._scan_region(lines[start:new_end], start, first)
+        instruction_lines = (cache['instruction_lines'][:start] + instruction_lines
+                             + cache['instruction_lines'][old_end:])
+
+        # (line, symbol, address) of every label, in program order:
+        # labels after the region moved along with the instructions
+        labels = [label for label in cache['labels'] if label[0] < start]
+        labels.extend(region_labels)
+        labels.extend((line - old_end + new_end, symbol, address + shift)
+                      for line, symbol, address in cache['labels'] if line >= old_end)
+        addresses = self._allocate(labels, symbols)
+
+        # Fill in the region's holes, then patch the instructions whose symbol moved
+        for symbol, indices in region.unresolved.items():
+            for index in indices:
+                self.words[first + index] = self._check_address(symbol, addresses[symbol])
+        old_addresses = cache['addresses']
+        moved = {symbol for symbol, address in addresses.items() if old_addresses.get(symbol) != address}
+        # Indices of the patched instructions outside of the region
+        self._patched = []
+        if moved:
+            for index, symbol in enumerate(symbols):
+                if symbol in moved and not first <= index < region_end:
+                    self.words[index] = self._check_address(symbol, addresses[symbol])
+                    self._patched.append(index)
+        self._region = (first, old_last, region_end)
+        self.encoded = len(region.words)
+        self.patched = len(self._patched)
+
+        self._cache = {
+            'version': self._CACHE_VERSION,
+            'lines': lines,
+            'instruction_lines': instruction_lines,
+            'labels': labels,
+            'words': self.words,
+            'symbols': symbols,
+            'addresses': addresses,
+        }
+
+    def _write_text(self, old_count):
+        """
+        Writes the .hack file. Every line of a .hack file has the same length,
+        so the previous output is reused: only the changed region and the
+        patched instructions are formatted again.
+        """
+        line_size = Code.WORD_SIZE + 1
+        try:
+            with open(self._output_filename, 'rb') as hack_file:
+                old_text = hack_file.read()
+        except OSError:
+            old_text = b''
+        if len(old_text) != old_count * line_size:
+            with open(self._output_filename, 'w') as hack_file:
+                Rom.write_text(self.words, hack_file)
+            return
+
+        first, old_last, region_end = self._region
+        region_text = ''.join(f"{word:016b}\n" for word in self.words[first:region_end]).encode()
+        text = bytearray(old_text[:first * line_size])
+        text += region_text
+        text += old_text[old_last * line_size:]
+        for index in self._patched:
+            text[index * line_size:(index + 1) * line_size - 1] = f"{self.words[index]:016b}".encode()
+        with open(self._output_filename, 'wb') as hack_file:
+            hack_file.write(text)
+
+    def _find_changed_region(self, old, new):
+        """
+        Finds the region of lines that differs between the old and new program,
+        by skipping their common leading and trailing lines.
+
+        Returns: (start, old_end, new_end) -- the region is old[start:old_end]
+        in the old program and new[start:new_end] in the new program
+        """
+        start = self._common_length(old, new)
+        end = self._common_length(reversed(old[start:]), reversed(new[start:]))
+        return start, len(old) - end, len(new) - end
+
+    def _common_length(self, old, new):
+        """Returns the number of leading lines the old and new lines have in common."""
+        count = 0
+        for old_line, new_line in zip(old, new):
+            if old_line != new_line:
+                break
+            count += 1
+        return count
+
+    def _scan_region(self, lines, start, first):
+        """
+        Finds which lines of the changed region hold instructions and labels.
+
+        Arguments:
+        lines -- the lines of the changed region
+        start -- line number of the region's first line
+        first -- ROM address of the region's first instruction
+        Returns: (instruction_lines, labels) -- a 0/1 byte per line, and the
+        (line, symbol, address) of each label in the region
+        """
+        instruction_lines = bytearray(len(lines))
+        labels = []
+        address = first
+        for index, line in enumerate(lines):
+            command = strip_command(line)
+            if command.startswith('('):
+                labels.append((start + index, parse_symbol(command), address))
+            elif command:
+                instruction_lines[index] = 1
+                address += 1
+        return bytes(instruction_lines), labels
+
+    def _allocate(self, labels, symbols):
+        """
+        Computes the address of every label and variable of the new program.
+
+        Returns: a dict mapping each symbol to its address
+        """
+        symbol_table = SymbolTable()
+        addresses = {}
+        for _, symbol, address in labels:
+            symbol_table.add_entry(symbol, address)
+            addresses[symbol] = address
+        # Variables are allocated in order of first use, as the assembler does
+        for symbol in dict.fromkeys(symbols):
+            if symbol is not None and not symbol_table.contains(symbol):
+                symbol_table.add_variable(symbol)
+                addresses[symbol] = symbol_table.get_address(symbol)
+        return addresses
+
+    def _check_address(self, symbol, address):
+        if address > Code.MAX_ADDRESS:
+            raise AssemblerError(f"Address {address} of {symbol} is too large.")
+        return address
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Re-assembles a Hack program, reusing the previous run.")
+    arg_parser.add_argument('filename', help="the .asm program to assemble")
+    arg_parser.add_argument('--rom', action='store_true',
+                            help="write a binary ROM image (.rom) instead of a .hack file")
+    args = arg_parser.parse_args()
+    assembler = IncrementalAssembler(args.filename, output_format=('hack', 'rom')[args.rom])
+    print(f"{assembler.encoded} instructions encoded, {assembler.patched} addresses patched")
@@ -0,0 +1,227 @@
+###############################################################################
+# 06-assembler/optimizer.py
+# -------------------------
+# The PeepholeOptimizer rewrites Hack assembly programs (typically the output
+# of the VM translator) into equivalent, shorter and faster programs.
+# It runs a configurable set of peephole rules over the instruction list,
+# repeating them until none of them applies anymore:
+#   push_pop       -- a push of D/constant immediately popped back into D or A
+#   redundant_load -- an A-instruction loading the value A already holds
+#   unreachable    -- instructions following an unconditional jump (up to the
+#                     next label, which may be the target of another jump)
+#   jump_threading -- a jump to a label whose code only jumps somewhere else
+#                     goes straight to the final destination
+#
+# Programs must only jump to labels: since instructions are removed, absolute
+# ROM addresses (e.g. `@133` followed by `0;JMP`) would no longer be valid.
+#
+# To run: python optimizer.py [--rules RULE,...] <program>.asm
+# (writes the optimized program to <program>.opt.asm)
+#
+###############################################################################
+
+import argparse
+import re
+from parser import find_absolute_jump
+from parser import parse_symbol
+from parser import read_commands
+
+
+class PeepholeOptimizer:
+    RULES = ('push_pop', 'redundant_load', 'unreachable', 'jump_threading')
+
+    # Values pushed by the VM translator's push templates (`M=<value>`)
+    _PUSHED_VALUES = ('D', '0', '1', '-1')
+
+    # Upper bound on the number of passes over the program
+    _MAX_PASSES = 100
+
+    def __init__(self, rules=RULES):
+        """
+        Arguments: rules -- names of the rules to apply (default: all of them)
+        """
+        for rule in rules:
+            if rule not in self.RULES:
+                raise OptimizerError(f"Unknown rule: {rule}")
+        self._rules = rules
+        # Number of instructions removed (or jumps threaded) by each rule
+        self.stats = dict.fromkeys(rules, 0)
+
+    def optimize(self, source):
+        """
+        Optimizes the program.
+
+        Arguments: source -- the assembly program (string or iterable of lines)
+        Returns: the optimized program, as a list of commands (labels included)
+        """
+        commands = read_commands(source)
+        absolute_jump = find_absolute_jump(commands)
+        if absolute_jump is not None:
+            raise OptimizerError(f"Jump to absolute address {absolute_jump}: only label targets can be optimized.")
+
+        for _ in range(self._MAX_PASSES):
+            changed = False
+            for rule in self._rules:
+                commands, count = getattr(self, f"_{rule}")(commands)
+                self.stats[rule] += count
+                changed = changed or count > 0
+            if not changed:
+                break
+        return commands
+
+    # ---------- C-INSTRUCTION FIELDS ----------
+
+    def _is_c_instruction(self, command):
+        return not command.startswith(('@', '('))
+
+    def _dest(self, command):
+        """Returns the dest field of a C-instruction ('' if none)."""
+        return command.split('=', 1)[0] if '=' in command else ''
+
+    def _comp(self, command):
+        """Returns the comp field of a C-instruction."""
+        return command.split('=', 1)[-1].split(';', 1)[0]
+
+    def _jump(self, command):
+        """Returns the jump field of a C-instruction (None if none, or not a C-instruction)."""
+        if not self._is_c_instruction(command) or ';' not in command:
+            return None
+        return command.split(';', 1)[1]
+
+    # ---------- RULES ----------
+    # Each rule takes the list of commands and returns the rewritten list along
+    # with the number of instructions it removed (or rewrote).
+
+    def _push_pop(self, commands):
+        """
+        Removes a push immediately followed by a pop:
+            @SP, M=M+1, A=M-1, M=<x>, @SP, AM=M-1, <r>=M
+        leaves D=<x> (r=D) and only clobbers the A register and the (free)
+        stack slot above SP. It is only removed when the next instruction is
+        an A-instruction, which overwrites A anyway.
+        """
+        output = []
+        removed = 0
+        i = 0
+        while i < len(commands):
+            window = commands[i:i + 7]
+            if (len(window) == 7 and window[:3] == ['@SP', 'M=M+1', 'A=M-1'] and window[4:6] == ['@SP', 'AM=M-1']
+                    and window[3][:2] == 'M=' and window[3][2:] in self._PUSHED_VALUES
+                    and window[6] in ('D=M', 'A=M')
+                    and i + 7 < len(commands) and commands[i + 7].startswith('@')):
+                value = window[3][2:]
+                replacement = [f'D={value}'] if window[6] == 'D=M' and value != 'D' else []
+                output.extend(replacement)
+                removed += 7 - len(replacement)
+                i += 7
+            else:
+                output.append(commands[i])
+                i += 1
+        return output, removed
+
+    def _redundant_load(self, commands):
+        """Removes A-instructions loading the value the A register already holds."""
+        output = []
+        removed = 0
+        # Symbol/constant currently held by A (None when unknown)
+        loaded = None
+        for command in commands:
+            if command.startswith('('):
+                # Can be reached by a jump, with any value in A
+                loaded = None
+            elif command.startswith('@'):
+                if command == loaded:
+                    removed += 1
+                    continue
+                loaded = command
+            elif 'A' in self._dest(command) or self._jump(command) == 'JMP':
+                loaded = None
+            output.append(command)
+        return output, removed
+
+    def _unreachable(self, commands):
+        """Removes the instructions between an unconditional jump and the next label."""
+        output = []
+        removed = 0
+        reachable = True
+        for command in commands:
+            if command.startswith('('):
+                reachable = True
+            elif not reachable:
+                removed += 1
+                continue
+            elif self._jump(command) == 'JMP':
+                reachable = False
+            output.append(command)
+        return output, removed
+
+    def _jump_threading(self, commands):
+        """
+        Redirects `@L1` + jump to `@L2` when the code at label L1 is just
+        `@L2` + unconditional jump (following chains of such jumps).
+        """
+        # First instruction following each label
+        entries = {}
+        for i, command in enumerate(commands):
+            if command.startswith('('):
+                entry = i + 1
+                while entry < len(commands) and commands[entry].startswith('('):
+                    entry += 1
+                entries[parse_symbol(command)] = entry
+
+        def trampoline_target(label):
+            """Returns the label the code at `label` jumps to unconditionally (or None)."""
+            entry = entries.get(label)
+            if entry is None or entry + 1 >= len(commands):
+                return None
+            load, jump = commands[entry], commands[entry + 1]
+            if load.startswith('@') and self._jump(jump) == 'JMP' and '=' not in jump and not load[1:].isdigit():
+                return load[1:]
+            return None
+
+        output = list(commands)
+        threaded = 0
+        for i, command in enumerate(commands[:-1]):
+            jump = commands[i + 1]
+            if not command.startswith('@') or self._jump(jump) is None:
+                continue
+            # The jump must not use A (other than as the target) nor fall
+            # through into code that could read it
+            if '=' in jump or re.search('[AM]', self._comp(jump)):
+                continue
+            if self._jump(jump) != 'JMP' and not (i + 2 < len(commands) and commands[i + 2].startswith('@')):
+                continue
+            target = command[1:]
+            visited = {target}
+            while True:
+                next_target = trampoline_target(target)
+                if next_target is None or next_target in visited:
+                    break
+                visited.add(next_target)
+                target = next_target
+            if target != command[1:]:
+                output[i] = f'@{target}'
+                threaded += 1
+        return output, threaded
+
+
+# For optimizer error exception; does nothing (just for convention)
+class OptimizerError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Applies peephole optimizations to a Hack assembly program.")
+    arg_parser.add_argument('filename', help="the .asm program to optimize")
+    arg_parser.add_argument('--rules', default=','.join(PeepholeOptimizer.RULES),
+                            help=f"comma-separated rules to apply (default: {','.join(PeepholeOptimizer.RULES)})")
+    args = arg_parser.parse_args()
+
+    optimizer = PeepholeOptimizer(args.rules.split(','))
+    with open(args.filename) as asm_file:
+        commands = optimizer.optimize(asm_file)
+    output_filename = re.compile(r'(\.asm)?$', re.IGNORECASE).sub('.opt.asm', args.filename, count=1)
+    with open(output_filename, 'w') as asm_file:
+        asm_file.writelines(f"{('    ', '')[command.startswith('(')]}{command}\n" for command in commands)
+    for rule, count in optimizer.stats.items():
+        print(f"{rule:<16} {count:>7}")
@@ -12,22 +12,93 @@ from code import Code
 from code import Translate
 
 
+# Symbol or constant of an A-command (@Xxx) or label (Xxx)
+_SYMBOL = re.compile(r'@([a-zA-Z0-9_.$:]+)|\(([a-zA-Z0-9_.$:]+)\)')
+
+
+def strip_command(line):
+    """Returns the command on a line of assembly, without comments and whitespace ('' if none)."""
+    return line.split('//', 1)[0].strip()
+
+
+def parse_symbol(command):
+    """
+    Returns the symbol or constant of an @Xxx/(Xxx) command.
+
+    Raises ParserError if the command is not a well-formed A-command or label.
+    """
+    match = _SYMBOL.fullmatch(command)
+    if match is None:
+        raise ParserError(f"Invalid symbol: {command}")
+    return match.group(1) or match.group(2)
+
+
+def read_commands(source):
+    """
+    Returns the commands of a program, without comments, whitespace and blank
+    lines (A-commands and labels are checked with parse_symbol()).
+
+    Arguments: source -- the assembly program (string or iterable of lines)
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+    commands = []
+    for line in source:
+        command = strip_command(line)
+        if command:
+            if command.startswith(('@', '(')):
+                parse_symbol(command)
+            commands.append(command)
+    return commands
+
+
+def find_absolute_jump(commands):
+    """
+    Returns the first A-command loading a constant that a jump uses as its
+    target (the next instruction, past any labels, has a jump field), or None.
+
+    Programs jumping to absolute ROM addresses cannot have instructions moved
+    or removed, since their targets would no longer be valid.
+    """
+    for i, command in enumerate(commands):
+        if command.startswith('@') and command[1:].isdigit():
+            j = i + 1
+            while j < len(commands) and commands[j].startswith('('):
+                j += 1
+            if j < len(commands) and not commands[j].startswith('@') and ';' in commands[j]:
+                return command
+    return None
+
+
 class Parser:
     
-    def __init__(self, filename):
+    def __init__(self, source):
         """
         Constructs Parser object by opening input file/stream for parsing.
+
+        The source is either a filename or an in-memory list of lines (in
+        which case the program is parsed without touching disk).
         """
-        self._file = open(filename)
+        if isinstance(source, str):
+            self._file = open(source)
+            self._lines = None
+        else:
+            self._file = None
+            self._lines = source
         self.reset()
 
     def close(self):
         """Closes the input file/stream."""
-        self._file.close()
+        if self._file:
+            self._file.close()
 
     def reset(self):
         """Rewinds the input file/stream to the beginning for second pass/read."""
-        self._file.seek(0)
+        if self._file:
+            self._file.seek(0)
+            self._remaining_lines = iter(self._file)
+        else:
+            self._remaining_lines = iter(self._lines)
         # Must read (initialize) next command for has_more_commands() to
         # function properly, since advance() has not been called yet and
         # there is no current command initially.
@@ -55,18 +126,19 @@ class Parser:
 
         All comments and extra whitespaces are removed in the process.
         """
-        while True:
-            command = self._file.readline()
-            # Check EOF
-            if not command:
-                self._next_command = None
-                break
+        for command in self._remaining_lines:
             # Remove comments and extra whitespace from line
-            command = command[:command.find('//')].strip()
+            command = strip_command(command)
             # Read line until non-whitespace found
             if command:
                 self._next_command = command
-                break
+                return
+        # EOF
+        self._next_command = None
+
+    def command(self):
+        """Returns the text of the current command."""
+        return self._command
 
     def command_type(self):
         """Returns the type of the current command."""
@@ -79,7 +151,7 @@ class Parser:
 
     def symbol(self):
         """Returns the symbol or constant @Xxx/(Xxx) of the current command."""
-        return re.search(r'[(@]([a-zA-Z0-9_.$:]+)\)?', self._command).group(1)
+        return parse_symbol(self._command)
 
     def dest(self):
         """Returns the 'dest' mnemonic in the current C-Instruction."""
@@ -97,7 +169,7 @@ class Parser:
         """Returns the field type from the given C-Instruction."""
         fields = self._split_c_instruction()
         if fields[ftype] not in Translate.CODES[ftype]:
-            raise ParserError("Invalid {ftype}: {fields[ftype]}")
+            raise ParserError(f"Invalid {ftype}: {fields[ftype]}")
         return fields[ftype]
 
     def _split_c_instruction(self):
@@ -117,6 +189,87 @@ class Parser:
         return {'dest': dest, 'comp': comp, 'jump': jump}
 
 
+class BulkParser(Parser):
+    """
+    Parses the whole program up front instead of one line at a time.
+
+    The entire source is read at once and every line is classified by a
+    single precompiled pattern (using `findall`), producing a compact list
+    of (command type, operand) records. The records are then handed out
+    through the same interface as Parser, so both assembler passes can
+    consume them without re-reading or re-parsing the source.
+    """
+
+    _COMMAND_TYPES = {'@': 'A_COMMAND', '(': 'L_COMMAND', '': 'C_COMMAND'}
+
+    # One match per non-empty line, giving an (at, paren, operand, invalid)
+    # record: the '@' or '(' prefix tells the command type, and the operand is
+    # the symbol (A/L commands, with the same characters as parse_symbol(), and
+    # a closing paren required for labels) or the instruction text (C commands).
+    # Any other text is captured as invalid. Blank and comment-only lines do
+    # not match.
+    _COMMAND = re.compile(r"""
+        ^[ \t]* (?:(@)|(\())? ((?(1)[a-zA-Z0-9_.$:]+|(?(2)[a-zA-Z0-9_.$:]+|[^\s/()@]+))) (?(2)\))
+          [ \t\r]* (?://[^\n]*)? $
+        | ^[ \t]* ((?!//)\S[^\n]*) $
+        """, re.MULTILINE | re.VERBOSE)
+
+    def __init__(self, source):
+        """
+        Reads and parses the whole input at once.
+
+        The source is either a filename or an in-memory list of lines.
+        """
+        if isinstance(source, str):
+            with open(source) as asm_file:
+                text = asm_file.read()
+        else:
+            text = '\n'.join(line.rstrip('\n') for line in source)
+
+        self._records = self._COMMAND.findall(text)
+        if any(invalid for _, _, _, invalid in self._records):
+            self._raise_invalid(text)
+        self.reset()
+
+    def _raise_invalid(self, text):
+        """Reports the first invalid command in the program text (with its line number)."""
+        for match in self._COMMAND.finditer(text):
+            if match.group(4):
+                line = text.count('\n', 0, match.start()) + 1
+                raise ParserError(f"Invalid command on line {line}: {match.group(4)}")
+
+    def close(self):
+        """Nothing to close: the input was read entirely up front."""
+        pass
+
+    def reset(self):
+        """Rewinds to the first command for second pass/read."""
+        self._index = 0
+        self._command = None
+
+    def has_more_commands(self):
+        """Checks if there are more commands in the program."""
+        return self._index < len(self._records)
+
+    def advance(self):
+        """Makes the next parsed command the current command."""
+        at, paren, self._command, _ = self._records[self._index]
+        self._prefix = at or paren
+        self._index += 1
+
+    def command_type(self):
+        """Returns the type of the current command."""
+        return self._COMMAND_TYPES[self._prefix]
+
+    def symbol(self):
+        """Returns the symbol or constant @Xxx/(Xxx) of the current command."""
+        return self._command
+
+    def __len__(self):
+        """Returns the number of commands in the program."""
+        return len(self._records)
+
+
 # For parsing error exception; does nothing (meant for convention)
 class ParserError(Exception):
     pass
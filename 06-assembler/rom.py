@@ -0,0 +1,92 @@
+###############################################################################
+# 06-assembler/rom.py
+# -------------------
+# The Rom module writes and loads assembled Hack programs.
+# A program is a buffer of 16-bit instruction words, which can be stored as:
+#   - a text .hack file (one 16-character binary code per line), or
+#   - a binary .rom image (the words packed back to back, 2 bytes each),
+#     which can be memory-mapped and loaded with a single read.
+#
+###############################################################################
+
+import mmap
+import sys
+from array import array
+from itertools import islice
+from code import Code
+
+
+class Rom:
+    SIZE = 32768            # The Hack ROM holds 32K instruction words
+    WORD_BYTES = 2          # Words are 16-bits long
+    BYTEORDER = 'little'    # Default byte order of binary ROM images
+
+    # Number of words written at a time when writing from an iterator
+    _CHUNK_WORDS = 4096
+
+    @staticmethod
+    def write_text(words, stream):
+        """Writes the words (any iterable) as a text .hack program to a (text) stream."""
+        stream.writelines(f"{Code.binary(word)}\n" for word in words)
+
+    @staticmethod
+    def write_binary(words, stream, byteorder=BYTEORDER):
+        """Writes the words (any iterable) as a packed binary ROM image to a (binary) stream."""
+        words = iter(words)
+        while True:
+            chunk = array('H', islice(words, Rom._CHUNK_WORDS))
+            if not chunk:
+                break
+            if byteorder != sys.byteorder:
+                chunk.byteswap()
+            stream.write(chunk.tobytes())
+
+    @staticmethod
+    def load_text(filename):
+        """Loads a text .hack program. Returns: the instruction words (array)"""
+        with open(filename) as hack_file:
+            words = array('H', (int(line, 2) for line in hack_file if line.strip()))
+        Rom._check_size(filename, len(words))
+        return words
+
+    @staticmethod
+    def load_binary(filename, byteorder=BYTEORDER):
+        """
+        Loads a binary ROM image by memory-mapping it.
+
+        Returns: the instruction words, as a read-only view of the mapped file
+        when its byte order is the native one, otherwise as a (swapped) array.
+        """
+        with open(filename, 'rb') as rom_file:
+            size = rom_file.seek(0, 2)
+            if size % Rom.WORD_BYTES:
+                raise RomError(f"{filename}: size {size} is not a whole number of words.")
+            Rom._check_size(filename, size // Rom.WORD_BYTES)
+            if size == 0:
+                return array('H')
+            # The mapping stays valid after the file is closed
+            image = mmap.mmap(rom_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if byteorder == sys.byteorder:
+            return memoryview(image).cast('H')
+        words = array('H')
+        words.frombytes(image)
+        words.byteswap()
+        return words
+
+    @staticmethod
+    def load(filename, byteorder=BYTEORDER):
+        """Loads either a text .hack program or a binary ROM image (by extension)."""
+        if filename.lower().endswith('.hack'):
+            return Rom.load_text(filename)
+        return Rom.load_binary(filename, byteorder)
+
+    @staticmethod
+    def _check_size(filename, count):
+        if count > Rom.SIZE:
+            raise RomError(f"{filename}: {count} words do not fit in the {Rom.SIZE}-word ROM.")
+
+
+# For ROM image error exception; does nothing (just for convention)
+class RomError(Exception):
+    pass
@@ -0,0 +1,120 @@
+###############################################################################
+# 06-assembler/symbol_map.py
+# --------------------------
+# The SymbolMap keeps what the assembler knows about a program once it is
+# assembled, for the tools working on its machine code (emulators, profilers,
+# the disassembler):
+#   - the source line of each ROM address,
+#   - the ROM address of each label,
+#   - the RAM address of each variable.
+#
+# It is written next to the program as a JSON-lines sidecar (<program>.map):
+#   {"program": "Pong.asm", "words": 27483}
+#   {"lines": [<source line of address 0>, <of address 1>, ...]}
+#   {"label": "END_EQ", "address": 19}
+#   {"variable": "ball.0", "address": 16}
+#   ...
+# Source lines are numbered from 1, and stored as a single array indexed by
+# ROM address, so that looking up an address needs no search.
+#
+###############################################################################
+
+import json
+from array import array
+from bisect import bisect_right
+from parser import parse_symbol
+from parser import strip_command
+from symbol_table import SymbolTable
+
+
+class SymbolMap:
+
+    def __init__(self, program='', lines=(), labels=None, variables=None):
+        """
+        Arguments:
+        program -- name of the source program
+        lines -- source line of each ROM address (iterable of ints)
+        labels -- dict mapping each label to its ROM address
+        variables -- dict mapping each variable to its RAM address
+        """
+        self.program = program
+        self.lines = array('L', lines)
+        self.labels = labels or {}
+        self.variables = variables or {}
+        # Label addresses in ascending order (the last label declared at an
+        # address comes last), for finding the label an address belongs to
+        self._label_index = sorted(((address, name) for name, address in self.labels.items()),
+                                   key=lambda label: label[0])
+        self._label_addresses = [address for address, _ in self._label_index]
+
+    @classmethod
+    def from_source(cls, source, program=''):
+        """
+        Builds the map of a program from its source, allocating variables in
+        order of first use like the assembler does.
+
+        Arguments: source -- the assembly program (string or iterable of lines)
+        """
+        if isinstance(source, str):
+            source = source.splitlines()
+        lines = []
+        labels = {}
+        # Symbols of the A-instructions, in order of first use
+        symbols = {}
+        for number, line in enumerate(source, 1):
+            command = strip_command(line)
+            if command.startswith('('):
+                labels[parse_symbol(command)] = len(lines)
+            elif command:
+                if command.startswith('@'):
+                    symbol = parse_symbol(command)
+                    if not symbol.isdigit():
+                        symbols.setdefault(symbol)
+                lines.append(number)
+
+        symbol_table = SymbolTable()
+        variables = {}
+        for symbol in symbols:
+            if symbol not in labels and not symbol_table.contains(symbol):
+                symbol_table.add_variable(symbol)
+                variables[symbol] = symbol_table.get_address(symbol)
+        return cls(program, lines, labels, variables)
+
+    def line(self, address):
+        """Returns the source line of the instruction at the ROM address."""
+        return self.lines[address]
+
+    def label(self, address):
+        """Returns the label the ROM address belongs to (the closest one declared before it), or None."""
+        index = bisect_right(self._label_addresses, address)
+        return self._label_index[index - 1][1] if index else None
+
+    def write(self, stream):
+        """Writes the map as JSON lines to a (text) stream."""
+        records = [{'program': self.program, 'words': len(self.lines)}, {'lines': self.lines.tolist()}]
+        records.extend({'label': name, 'address': address} for name, address in self.labels.items())
+        records.extend({'variable': name, 'address': address} for name, address in self.variables.items())
+        stream.writelines(f"{json.dumps(record, separators=(',', ':'))}\n" for record in records)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a map written by write()."""
+        program, lines, labels, variables = '', (), {}, {}
+        with open(filename) as map_file:
+            for record in map(json.loads, map_file):
+                if 'label' in record:
+                    labels[record['label']] = record['address']
+                elif 'variable' in record:
+                    variables[record['variable']] = record['address']
+                elif 'lines' in record:
+                    lines = record['lines']
+                elif 'program' in record:
+                    program = record['program']
+                else:
+                    raise SymbolMapError(f"{filename}: unknown record {record}")
+        return cls(program, lines, labels, variables)
+
+
+# For symbol map error exception; does nothing (just for convention)
+class SymbolMapError(Exception):
+    pass
@@ -6,6 +6,10 @@
 #
 ###############################################################################
 
+import warnings
+from rom import Rom
+
+
 class SymbolTable:
 
     def __init__(self):
@@ -40,6 +44,10 @@ class SymbolTable:
         self.add_entry(symbol, self._variable_addr)
         self._variable_addr += 1
 
+    def next_variable_address(self):
+        """Returns the RAM address the next variable will be allocated."""
+        return self._variable_addr
+
     def contains(self, symbol):
         """Determines whether the symbol table contains a specific symbol."""
         return symbol in self._symbol_table
@@ -54,6 +62,8 @@ class SymbolTableBuilder:
     Builds the initial symbol table for the first pass.
     
     Only `L_COMMAND` types are added to the symbol table.
+    Warns when the program does not fit in ROM (see tree_shaker.py to find
+    which functions take up the space).
     """
 
     def __init__(self, parser):
@@ -69,5 +79,7 @@ class SymbolTableBuilder:
                 count += 1
             else:
                 symbol_table.add_entry(self._parser.symbol(), count)
+        if count > Rom.SIZE:
+            warnings.warn(f"Program has {count} instructions: it does not fit in the {Rom.SIZE}-word ROM.")
         return symbol_table
 
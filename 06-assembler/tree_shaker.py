@@ -0,0 +1,202 @@
+###############################################################################
+# 06-assembler/tree_shaker.py
+# ---------------------------
+# The TreeShaker fits large programs in the 32K-word Hack ROM by removing the
+# code that can never run, and reports which functions take up the space.
+#
+# The program is split into label-delimited regions (a region starts at a
+# label and runs up to the next one). Starting from the region at address 0,
+# a region reaches:
+#   - the next region, unless it ends with an unconditional jump, and
+#   - every region whose label it references (`@LABEL`), whether to jump
+#     there or to push it as a return address.
+# Regions that cannot be reached are dropped, and the remaining program is
+# assembled as usual.
+#
+# The size report groups the regions by function: the VM translator starts
+# every function with a `(CLASS.FUNCTION)` label, and the code before the
+# first function (the bootstrap) is reported as `(startup)`.
+#
+# Programs must only jump to labels: since regions are removed, absolute
+# ROM addresses (e.g. `@133` followed by `0;JMP`) would no longer be valid.
+#
+# The shaken program is written as <program>.hack (or .rom); with --map, its
+# symbol map is written too (<program>.map, see symbol_map.py), with the
+# source lines of the original program, so that the tools reading maps
+# (the profiler, the OS traps) run on shaken programs. With --asm, the
+# shaken assembly program is also written to a file.
+#
+# To run: python tree_shaker.py [--rom] [--map] [--asm FILE] [--report FILE] <program>.asm
+#
+###############################################################################
+
+import argparse
+import os
+import re
+from array import array
+from assembler import InMemoryAssembler
+from parser import find_absolute_jump
+from parser import parse_symbol
+from parser import read_commands
+from rom import Rom
+from symbol_map import SymbolMap
+
+
+class Region:
+    """A label-delimited block of the program."""
+
+    def __init__(self, labels, function, start):
+        self.labels = labels        # Labels declared at the start of the region
+        self.function = function    # Function the region belongs to
+        self.start = start          # Index of its first instruction in the program
+        self.commands = []          # Instructions (labels excluded)
+        self.reachable = False
+
+
+class TreeShaker:
+    # Entry labels written by the VM translator for each function: CLASS.FUNCTION
+    # (excluding return addresses and the labels of the locals initialization)
+    FUNCTION_LABEL = re.compile(r'^(?!RET_)[^.$]+\.[^.$]+(?<!_LCL_START)(?<!_LCL_END)$')
+
+    # Name of the code before the first function (the bootstrap)
+    STARTUP = '(startup)'
+
+    def __init__(self, source):
+        """
+        Splits the program into regions and finds the reachable ones.
+
+        Arguments: source -- the assembly program (string or iterable of lines)
+        """
+        if not isinstance(source, str):
+            source = list(source)
+        # Source of the program, for the source lines of the symbol map
+        self._source = source
+        commands = read_commands(source)
+        absolute_jump = find_absolute_jump(commands)
+        if absolute_jump is not None:
+            raise TreeShakerError(f"Jump to absolute address {absolute_jump}: only label targets can be followed.")
+        self.regions = self._split(commands)
+        self._mark_reachable()
+
+    def commands(self):
+        """Returns the commands of the reachable regions (labels included)."""
+        commands = []
+        for region in self.regions:
+            if region.reachable:
+                commands.extend(f'({label})' for label in region.labels)
+                commands.extend(region.commands)
+        return commands
+
+    def symbol_map(self, program=''):
+        """
+        Returns the SymbolMap of the shaken program: its labels and variables,
+        and the line of each instruction in the original source.
+        """
+        source_lines = SymbolMap.from_source(self._source).lines
+        lines = array('L')
+        for region in self.regions:
+            if region.reachable:
+                lines.extend(source_lines[region.start:region.start + len(region.commands)])
+        shaken = SymbolMap.from_source(self.commands())
+        return SymbolMap(program, lines, shaken.labels, shaken.variables)
+
+    def size(self, reachable_only=False):
+        """Returns the number of instruction words in the program (or in its reachable regions)."""
+        return sum(len(region.commands) for region in self.regions if region.reachable or not reachable_only)
+
+    def functions(self):
+        """
+        Returns the size of each function, largest first, as a list of
+        (function, words, kept) tuples -- its total size and the size
+        of its reachable regions.
+        """
+        sizes = {}
+        for region in self.regions:
+            words, kept = sizes.get(region.function, (0, 0))
+            sizes[region.function] = (words + len(region.commands),
+                                      kept + len(region.commands) * region.reachable)
+        return sorted(((function, words, kept) for function, (words, kept) in sizes.items()),
+                      key=lambda size: (-size[1], size[0]))
+
+    def report(self):
+        """Returns the size report (one line per function, then the totals)."""
+        lines = [f"{'function':<40} {'words':>7} {'kept':>7}"]
+        for function, words, kept in self.functions():
+            lines.append(f"{function:<40} {words:>7} {kept:>7}{('  (removed)', '')[kept > 0]}")
+        size, kept = self.size(), self.size(reachable_only=True)
+        lines.append(f"{'total':<40} {size:>7} {kept:>7}")
+        lines.append(f"{kept} of {Rom.SIZE} ROM words used ({kept / Rom.SIZE:.1%})"
+                     f"{('', ' -- DOES NOT FIT')[kept > Rom.SIZE]}"
+                     f"{('', f', {size - kept} removed')[size > kept]}")
+        return '\n'.join(lines) + '\n'
+
+    def _split(self, commands):
+        """Splits the commands into regions, each starting at a label (except the first one)."""
+        function = self.STARTUP
+        regions = [Region([], function, 0)]
+        instructions = 0
+        for command in commands:
+            if not command.startswith('('):
+                regions[-1].commands.append(command)
+                instructions += 1
+                continue
+            label = parse_symbol(command)
+            if self.FUNCTION_LABEL.match(label):
+                function = label
+            if regions[-1].commands:
+                regions.append(Region([label], function, instructions))
+            else:
+                # Labels with no instruction in between share the same region
+                regions[-1].labels.append(label)
+                regions[-1].function = function
+        return regions
+
+    def _mark_reachable(self):
+        """Marks the regions reachable from address 0 (depth-first)."""
+        region_index = {label: index for index, region in enumerate(self.regions) for label in region.labels}
+        pending = [0]
+        while pending:
+            index = pending.pop()
+            region = self.regions[index]
+            if region.reachable:
+                continue
+            region.reachable = True
+            pending.extend(region_index[command[1:]] for command in region.commands
+                           if command.startswith('@') and command[1:] in region_index)
+            # Falls through into the next region unless it ends with an unconditional jump
+            if not (region.commands and region.commands[-1].endswith(';JMP')) and index + 1 < len(self.regions):
+                pending.append(index + 1)
+
+
+# For tree shaker error exception; does nothing (just for convention)
+class TreeShakerError(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Removes unreachable code from a Hack program and reports its ROM usage.")
+    arg_parser.add_argument('filename', help="the .asm program to assemble")
+    arg_parser.add_argument('--rom', action='store_true',
+                            help="write a binary ROM image (.rom) instead of a .hack file")
+    arg_parser.add_argument('--map', action='store_true',
+                            help="also write the symbol and source map (.map) of the shaken program")
+    arg_parser.add_argument('--asm', metavar='FILE', help="also write the shaken assembly program to this file")
+    arg_parser.add_argument('--report', help="also write the size report to this file")
+    args = arg_parser.parse_args()
+
+    with open(args.filename) as asm_file:
+        shaker = TreeShaker(asm_file)
+    report = shaker.report()
+    print(report, end='')
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            report_file.write(report)
+    if shaker.size(reachable_only=True) > Rom.SIZE:
+        raise SystemExit(f"{args.filename}: the program does not fit in ROM, even without its unreachable code.")
+
+    commands = shaker.commands()
+    if args.asm:
+        with open(args.asm, 'w') as asm_file:
+            asm_file.writelines(f"{command}\n" for command in commands)
+    InMemoryAssembler(commands).save(args.filename, ('hack', 'rom')[args.rom],
+                                     shaker.symbol_map(os.path.basename(args.filename)) if args.map else None)
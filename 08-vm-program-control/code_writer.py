@@ -173,7 +173,7 @@ class CodeWriter:
 
         if command == 'push' and segment == 'constant':
             self._push_constant(index)
-        elif segment in self._VM_SEGMENTS['shared'].keys() + self._VM_SEGMENTS['instance'].keys():
+        elif segment in (*self._VM_SEGMENTS['shared'], *self._VM_SEGMENTS['instance']):
             self._push_pop_variable(command, segment, index)
         elif segment == 'static':
             self._push_pop_static(command, index)
@@ -61,7 +61,7 @@ class Parser:
                 self._next_command = None
                 break
             # Remove comments and extra whitespace from line if present
-            command = command[:command.find('//')].strip()
+            command = command.split('//', 1)[0].strip()
             # Read line until non-whitespace found
             if command:
                 self._next_command = command